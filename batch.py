@@ -0,0 +1,536 @@
+import os
+import re
+import json
+import time
+import queue
+import cProfile
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from PIL import Image
+
+from core import watermark_file, render_image, output_paths_for, write_atomic, STAGES, TEMP_SUFFIX, READ_FORMATS
+from manifest import Manifest
+from dedupe import DuplicateIndex, link_outputs
+
+TIMING_LOG_NAME = "watermark_timings.jsonl"
+PROFILE_NAME = "watermark_profile.prof"
+
+def default_workers():
+    return os.cpu_count() or 1
+
+_DONE = object()
+
+def _drain(q):
+    try:
+        while True:
+            q.get_nowait()
+    except queue.Empty:
+        pass
+
+def _process(image_path, settings):
+    timings = {} if settings.get("instrument") else None
+    out_paths = watermark_file(image_path, settings, timings)
+    return out_paths, timings
+
+def _render(image_path, data, settings):
+    timings = {} if settings.get("instrument") else None
+    outputs = render_image(data, image_path, settings, timings)
+    return outputs, timings
+
+# === Size-Sorted Scheduling ===
+def image_size(path):
+    # Header only; the pixels are not decoded.
+    try:
+        with Image.open(path, formats=READ_FORMATS) as image:
+            return image.size
+    except Exception:
+        return None
+
+PLAN_WINDOW = 256
+
+def _size_order(size):
+    return size is None, -(size[0] * size[1]) if size else 0, size or (0, 0)
+
+def plan_batch(image_paths, size_groups=None, window=PLAN_WINDOW, threads=4, cancel=None):
+    # Yields the batch grouped by (width, height) so each size's layout
+    # plan, resized logo and tile overlay are built once and then hit in
+    # cache for the rest of the group. Larger sizes go first, which also
+    # keeps the slowest images from trailing. Unreadable files go last and
+    # fail in the pipeline as usual. Headers are probed window by window on
+    # a few threads, so on a slow share the first images are composited
+    # while later ones are still being probed, and a cancel stops the probe.
+    # size_groups, if given, collects the image count per size.
+    paths = iter(image_paths)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        while cancel is None or not cancel.is_set():
+            chunk = list(itertools.islice(paths, window))
+            if not chunk:
+                break
+            groups = {}
+            for path, size in zip(chunk, executor.map(image_size, chunk)):
+                groups.setdefault(size, []).append(path)
+            for size in sorted(groups, key=_size_order):
+                if size_groups is not None:
+                    size_groups[size] = size_groups.get(size, 0) + len(groups[size])
+                yield from groups[size]
+
+# === Batch Statistics ===
+HISTOGRAM_EDGES_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+class BatchStats:
+    def __init__(self, total):
+        self.total = total
+        self.started = time.monotonic()
+        self.completed = 0
+        self.stages = {stage: self._empty_stage() for stage in STAGES}
+
+    @staticmethod
+    def _empty_stage():
+        return {"count": 0, "total": 0.0, "max": 0.0, "histogram": [0] * (len(HISTOGRAM_EDGES_MS) + 1)}
+
+    def add(self, timings=None):
+        self.completed += 1
+        for stage, seconds in (timings or {}).items():
+            entry = self.stages.setdefault(stage, self._empty_stage())
+            entry["count"] += 1
+            entry["total"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            ms = seconds * 1000
+            bucket = next((i for i, edge in enumerate(HISTOGRAM_EDGES_MS) if ms <= edge), len(HISTOGRAM_EDGES_MS))
+            entry["histogram"][bucket] += 1
+
+    def throughput(self):
+        elapsed = time.monotonic() - self.started
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+    def eta(self, done):
+        rate = self.throughput()
+        if not rate:
+            return None
+        return (self.total - done) / rate
+
+    def summary(self):
+        return {
+            "elapsed_s": round(time.monotonic() - self.started, 3),
+            "images_per_sec": round(self.throughput(), 3),
+            "histogram_edges_ms": list(HISTOGRAM_EDGES_MS),
+            "stages": {
+                stage: {
+                    "count": entry["count"],
+                    "mean_ms": round(entry["total"] / entry["count"] * 1000, 3) if entry["count"] else None,
+                    "max_ms": round(entry["max"] * 1000, 3),
+                    "histogram": entry["histogram"]
+                }
+                for stage, entry in self.stages.items() if entry["count"]
+            }
+        }
+
+# === Batch Engine ===
+JOURNAL_STATUS = {"ok": "done", "error": "failed", "skipped": "skipped", "duplicate": "done"}
+
+class BatchJob:
+    def __init__(self, image_paths, settings, workers=None, force=False, executor=None, on_file=None,
+                 journal=None, job_id=None, duplicates=None):
+        self.image_paths = list(image_paths)
+        self.settings = dict(settings)
+        self.workers = max(1, int(workers or settings.get("workers") or default_workers()))
+        self.force = force
+        # A caller-owned executor (e.g. the HTTP service's warm pool) is
+        # used as is and left running; on_file(path, status, detail) is
+        # told about each image as it settles.
+        self.executor = executor
+        self.on_file = on_file
+        # With a journal every file's outcome is committed as it settles;
+        # job_id set means this run resumes that job's queued files.
+        self.journal = journal
+        self.job_id = job_id
+        # A DuplicateIndex that may already be hashing the inputs (the GUI
+        # starts it during ingestion); one is made here if needed.
+        self.duplicate_index = duplicates
+        self.duplicates = {}
+        self.deduplicated = []
+        self.encodes_saved = 0
+        self.events = queue.Queue()
+        self.errors = []
+        self.skipped = []
+        self.size_groups = {}
+        self.done = 0
+        self.manifest = None
+        # Source fingerprints taken by the manifest check, reused when the
+        # image's outputs are recorded so each source is hashed only once.
+        self._fingerprints = {}
+        self.stats = BatchStats(len(self.image_paths))
+        self.instrument = bool(self.settings.get("instrument") or self.settings.get("profile"))
+        self.settings["instrument"] = self.instrument
+        self._timing_log = None
+        self._lock = threading.Lock()
+        self.cancelled = False
+        self._cancel = threading.Event()
+        self._thread = None
+
+    @property
+    def total(self):
+        return len(self.image_paths)
+
+    def error_lines(self):
+        return [f"{os.path.basename(path)}: {msg}" if path else msg for path, msg in self.errors]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def run(self):
+        output_dir = self.settings["output_dir"]
+        try:
+            self.manifest = Manifest(output_dir, self.settings)
+            if self.journal is not None and self.job_id is None:
+                self.job_id = self.journal.create_job(self.image_paths, self.settings, self.force)
+            if self.instrument:
+                self._timing_log = open(os.path.join(output_dir, TIMING_LOG_NAME), "a")
+            if self.settings.get("profile"):
+                # Profiling stays in this process so one .prof covers the
+                # whole run; worker processes would each need their own.
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    self._run_serial()
+                finally:
+                    profiler.disable()
+                    profiler.dump_stats(os.path.join(output_dir, PROFILE_NAME))
+            elif self.executor is not None:
+                self._run_pipeline(self.executor)
+            elif self.workers == 1:
+                # One compositing thread still gets prefetched reads and
+                # background writes, and keeps this process's caches warm.
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    self._run_pipeline(executor)
+            else:
+                # Spawned workers import only core.py, never Tk.
+                ctx = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx) as executor:
+                    self._run_pipeline(executor)
+        except Exception as e:
+            aborted = True
+            self.errors.append(("", f"Batch aborted: {e}"))
+        else:
+            aborted = False
+        finally:
+            if self._timing_log is not None:
+                self._timing_log.write(json.dumps({"summary": self.stats.summary()}) + "\n")
+                self._timing_log.close()
+            if self.manifest is not None:
+                try:
+                    self.manifest.save()
+                except OSError as e:
+                    self.errors.append(("", f"Failed to save manifest: {e}"))
+        self.cancelled = self._cancel.is_set()
+        if self.journal is not None and self.job_id is not None:
+            # An aborted job stays "running" so it is offered for resume.
+            if self.cancelled:
+                self.journal.set_status(self.job_id, "cancelled")
+            elif not aborted:
+                self.journal.set_status(self.job_id, "done")
+        self.events.put(("finished", self.done, self.total))
+        return self
+
+    def _finish_one(self, image_path, error=None, result=None, linked=None, fingerprint=None):
+        # Called from reader, writer and coordinator threads. linked holds
+        # the outputs of a duplicate that were linked, not encoded, and
+        # fingerprint the source's as taken when it was read.
+        # Nothing raised in here may escape: a dead writer thread would
+        # leave the coordinator blocked on a full write queue.
+        checked = self._fingerprints.pop(image_path, None)
+        if error is None and (linked is not None or result is not None):
+            # Taken outside the lock: with manifest_check "hash" this reads
+            # the whole source.
+            try:
+                if fingerprint is None:
+                    fingerprint = checked if checked is not None else self.manifest.fingerprint(image_path)
+            except Exception as e:
+                error = e  # e.g. the source was moved away once it was read
+        with self._lock:
+            timings = None
+            if error is None and (linked is not None or result is not None):
+                try:
+                    for out_path in (linked if linked is not None else result[0]):
+                        self.manifest.mark_done(image_path, out_path, fingerprint)
+                except Exception as e:
+                    error = e
+            if error is not None:
+                self.errors.append((image_path, str(error)))
+                status, detail = "error", str(error)
+            elif linked is not None:
+                self.deduplicated.append(image_path)
+                self.encodes_saved += len(linked)
+                status, detail = "duplicate", linked
+            elif result is not None:
+                timings = result[1]
+                status, detail = "ok", result[0]
+            else:
+                status, detail = "skipped", None
+            if result is not None or error is not None:
+                self.stats.add(timings)
+            self.done += 1
+            try:
+                if self._timing_log is not None and (result is not None or error is not None):
+                    self._log_timings(image_path, error, result)
+                if self.journal is not None:
+                    self.journal.mark(self.job_id, image_path, JOURNAL_STATUS[status], detail)
+                if self.on_file is not None:
+                    self.on_file(image_path, status, detail)
+            except Exception as e:
+                if status != "error":
+                    self.errors.append((image_path, f"Could not record the result: {e}"))
+            self.events.put(("progress", self.done, self.total))
+        self._finish_duplicates(image_path, error, result)
+
+    def _finish_duplicates(self, image_path, error=None, result=None):
+        # The duplicates of an image settle with it: linked to its outputs,
+        # failed with it, or (if it was never finished) left queued.
+        for duplicate in self.duplicates.pop(image_path, ()):
+            if error is not None:
+                self._finish_one(duplicate, RuntimeError(f"Same image as {os.path.basename(image_path)}: {error}"))
+                continue
+            try:
+                linked = link_outputs(result[0], output_paths_for(duplicate, self.settings),
+                                      self.settings.get("dedupe_link", True))
+            except Exception as e:
+                self._finish_one(duplicate, e)
+                continue
+            self._finish_one(duplicate, linked=linked)
+
+    def _log_timings(self, image_path, error, result):
+        record = {"path": image_path, "status": "error" if error is not None else "ok"}
+        if error is not None:
+            record["error"] = str(error)
+        else:
+            out_paths, timings = result
+            record["outputs"] = out_paths
+            record["stages_ms"] = {k: round(v * 1000, 3) for k, v in (timings or {}).items()}
+            record["total_ms"] = round(sum((timings or {}).values()) * 1000, 3)
+        self._timing_log.write(json.dumps(record) + "\n")
+
+    def _pending_paths(self):
+        io_threads = max(1, int(self.settings.get("io_threads", 4)))
+        pending = self._unsettled_paths(threads=io_threads)
+        if self.settings.get("dedupe", "off") != "off":
+            # Grouping needs every input, so this waits for the whole check.
+            pending = self._group_duplicates(list(pending))
+        if self.settings.get("schedule", "size") == "size":
+            pending = plan_batch(pending, self.size_groups, threads=io_threads, cancel=self._cancel)
+        yield from pending
+
+    def _unsettled_paths(self, window=PLAN_WINDOW, threads=4):
+        # Unchanged outputs are settled here, before their images are
+        # queued. The manifest is checked window by window on a few threads,
+        # like plan_batch's probes, so the first images are composited while
+        # later ones are still being stat'ed or hashed. An image whose
+        # output name another input already claimed (same file name, folders
+        # not given as inputs) fails rather than silently overwriting it.
+        claimed = {}
+        paths = iter(self.image_paths)
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            while not self._cancel.is_set():
+                chunk = list(itertools.islice(paths, window))
+                if not chunk:
+                    break
+                unclaimed = []
+                for img_path in chunk:
+                    try:
+                        out_paths = output_paths_for(img_path, self.settings)
+                    except ValueError:
+                        out_paths = []  # fails in the pipeline with its own message
+                    keys = [os.path.normcase(os.path.abspath(out_path)) for out_path in out_paths]
+                    owner = next((claimed[key] for key in keys if key in claimed), None)
+                    if owner is not None:
+                        self._finish_one(img_path, ValueError(f"Same output name as {owner}; "
+                                                              f"add their folders as inputs to keep both."))
+                        continue
+                    claimed.update((key, img_path) for key in keys)
+                    unclaimed.append((img_path, out_paths))
+                if self.force:
+                    yield from (img_path for img_path, _ in unclaimed)
+                    continue
+                for (img_path, _), current in zip(unclaimed, executor.map(self._check_manifest, unclaimed)):
+                    if current:
+                        self.skipped.append(img_path)
+                        self._finish_one(img_path)
+                    else:
+                        yield img_path
+
+    def _check_manifest(self, item):
+        img_path, out_paths = item
+        try:
+            current, fingerprint = self.manifest.check_outputs(img_path, out_paths)
+        except ValueError:
+            return False  # e.g. an output on another drive than the manifest
+        if fingerprint is not None and not current:
+            self._fingerprints[img_path] = fingerprint
+        return current
+
+    def _group_duplicates(self, pending):
+        index = self.duplicate_index
+        if index is None:
+            index = DuplicateIndex()
+            index.add(pending, self.settings["dedupe"])
+        try:
+            pending, self.duplicates = index.group(pending, self.settings)
+        finally:
+            if index is not self.duplicate_index:
+                index.close()
+        return pending
+
+    def _run_serial(self):
+        for img_path in self._pending_paths():
+            if self._cancel.is_set():
+                break
+            try:
+                self._finish_one(img_path, result=_process(img_path, self.settings))
+            except Exception as e:
+                self._finish_one(img_path, e)
+
+    def _put(self, q, item, halt=None):
+        # Blocking put that gives up once the batch is cancelled or halt is set.
+        while not self._cancel.is_set() and not (halt is not None and halt.is_set()):
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run_pipeline(self, executor):
+        # read -> composite -> write, joined by bounded queues so the
+        # slowest stage sets the pace: reader threads prefetch file bytes,
+        # the executor decodes, composites and encodes, and writer threads
+        # put the results on disk.
+        io_threads = max(1, int(self.settings.get("io_threads", 4)))
+        window = self.workers * 2
+        read_q = queue.Queue(maxsize=window)
+        write_q = queue.Queue(maxsize=window)
+        paths = self._pending_paths()
+        paths_lock = threading.Lock()
+        # Set when the coordinator stops taking reads, so no reader is left
+        # blocked on a full read_q holding its prefetched bytes.
+        halt = threading.Event()
+
+        def reader():
+            while not self._cancel.is_set() and not halt.is_set():
+                with paths_lock:
+                    img_path = next(paths, None)
+                if img_path is None:
+                    break
+                start = time.perf_counter()
+                try:
+                    with open(img_path, "rb") as f:
+                        data = f.read()
+                except OSError as e:
+                    self._finish_one(img_path, e)
+                    continue
+                read_s = time.perf_counter() - start
+                # Hash the bytes in hand rather than the file again later.
+                fingerprint = None
+                if self.manifest.check == "hash" and img_path not in self._fingerprints:
+                    fingerprint = self.manifest.fingerprint(img_path, data)
+                if not self._put(read_q, (img_path, data, read_s, fingerprint), halt):
+                    break
+            self._put(read_q, _DONE, halt)
+
+        def writer():
+            while True:
+                item = write_q.get()
+                if item is _DONE:
+                    break
+                img_path, outputs, timings, fingerprint = item
+                start = time.perf_counter()
+                try:
+                    for out_path, payload in outputs:
+                        write_atomic(out_path, payload)
+                except Exception as e:
+                    self._finish_one(img_path, e)
+                    continue
+                if timings is not None:
+                    timings["write"] = time.perf_counter() - start
+                self._finish_one(img_path, result=([out_path for out_path, _ in outputs], timings),
+                                 fingerprint=fingerprint)
+
+        readers = [threading.Thread(target=reader, daemon=True) for _ in range(io_threads)]
+        writers = [threading.Thread(target=writer, daemon=True) for _ in range(io_threads)]
+        for thread in readers + writers:
+            thread.start()
+
+        in_flight = {}
+        readers_done = 0
+        try:
+            while True:
+                while len(in_flight) < window and readers_done < io_threads and not self._cancel.is_set():
+                    try:
+                        item = read_q.get(timeout=0.05 if in_flight else 0.2)
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        readers_done += 1
+                        continue
+                    img_path, data, read_s, fingerprint = item
+                    in_flight[executor.submit(_render, img_path, data, self.settings)] = (img_path, read_s, fingerprint)
+
+                if not in_flight:
+                    if readers_done == io_threads or self._cancel.is_set():
+                        break
+                    continue
+
+                finished, _ = wait(in_flight, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    img_path, read_s, fingerprint = in_flight.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        self._finish_one(img_path, error)
+                        continue
+                    outputs, timings = future.result()
+                    if timings is not None:
+                        timings["read"] = read_s
+                    write_q.put((img_path, outputs, timings, fingerprint))
+        finally:
+            halt.set()
+            for thread in readers:
+                while thread.is_alive():
+                    _drain(read_q)
+                    thread.join(0.05)
+            _drain(read_q)
+            for _ in writers:
+                write_q.put(_DONE)
+            for thread in writers:
+                thread.join()
+
+# === Resume ===
+STALE_TEMP = re.compile(r"_watermarked.*\.\d+\.\w+" + re.escape(TEMP_SUFFIX) + "$")
+
+def remove_stale_temps(output_dir):
+    # Half-written outputs left by a run that died between write and rename.
+    for directory, _, names in os.walk(output_dir):
+        for name in names:
+            if STALE_TEMP.search(name):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+def resume_job(journal, job_id, workers=None):
+    settings, force = journal.job_settings(job_id)
+    # Another process still working through this job would lose its
+    # temporary files and race this one for the same outputs.
+    owner = journal.live_owner(job_id)
+    if owner is not None:
+        raise RuntimeError(f"Job {job_id} is still running in process {owner[0]} on {owner[1]}.")
+    journal.claim(job_id)
+    os.makedirs(settings["output_dir"], exist_ok=True)
+    remove_stale_temps(settings["output_dir"])
+    return BatchJob(journal.pending_paths(job_id), settings, workers, force=force, journal=journal, job_id=job_id)
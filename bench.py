@@ -0,0 +1,361 @@
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import multiprocessing
+
+from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+import core
+from blend import BLEND_MODES
+
+LAYOUTS = core.POSITIONS + ("tiled",)
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere.
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+# === Synthetic Corpus ===
+def make_base(megapixels, seed=0):
+    width = int((megapixels * 1e6 * 1.5) ** 0.5)
+    height = int(width / 1.5)
+    # A blurred noise field compresses like a photo, unlike pure noise.
+    small = Image.effect_noise((max(1, width // 16), max(1, height // 16)), 64 + seed)
+    small = Image.merge("RGB", (small, small.rotate(90, expand=False), small.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    return small.resize((width, height), Image.Resampling.BILINEAR).filter(ImageFilter.GaussianBlur(2))
+
+def make_logo(transparent):
+    logo = Image.new("RGBA", (1200, 400), (0, 0, 0, 0) if transparent else (255, 255, 255, 255))
+    draw = ImageDraw.Draw(logo)
+    draw.rounded_rectangle((40, 40, 1160, 360), radius=80, fill=(200, 30, 40, 230), outline=(20, 20, 20, 255), width=12)
+    draw.ellipse((100, 100, 300, 300), fill=(255, 255, 255, 255))
+    return logo
+
+def camera_metadata(index):
+    # JPEGs look like camera output: an sRGB profile, and every other one
+    # stored sideways with EXIF orientation 6 so the metadata stage pays
+    # for a real transpose.
+    exif = Image.Exif()
+    exif[core.ORIENTATION_TAG] = 6 if index % 2 else 1
+    params = {"quality": 90, "exif": exif.tobytes()}
+    try:
+        from PIL import ImageCms
+        params["icc_profile"] = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    except ImportError:
+        pass
+    return params
+
+def build_corpus(directory, sizes, formats, count):
+    os.makedirs(directory, exist_ok=True)
+    images = {}
+    for mp in sizes:
+        for fmt in formats:
+            paths = []
+            for i in range(count):
+                name = f"base_{mp}mp_{i}_camera.jpg" if fmt == "jpeg" else f"base_{mp}mp_{i}.{fmt}"
+                path = os.path.join(directory, name)
+                if not os.path.exists(path):
+                    params = camera_metadata(i) if fmt == "jpeg" else {}
+                    make_base(mp, i).save(path, **params)
+                paths.append(path)
+            images[(mp, fmt)] = paths
+    logos = {}
+    for kind in ("opaque", "transparent"):
+        path = os.path.join(directory, f"logo_{kind}.png")
+        if not os.path.exists(path):
+            make_logo(kind == "transparent").save(path)
+        logos[kind] = path
+    return images, logos
+
+# === Stage Timing ===
+def percentiles(samples, points=(50, 90, 99)):
+    ordered = sorted(samples)
+    result = {}
+    for p in points:
+        index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+        result[f"p{p}"] = round(ordered[index] * 1000, 3)
+    result["mean"] = round(sum(ordered) / len(ordered) * 1000, 3)
+    return result
+
+def time_image(image_path, logo_path, layout, settings):
+    timings = {}
+
+    t = time.perf_counter()
+    base = Image.open(image_path)
+    base.load()
+    timings["decode"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    base, metadata = core.read_metadata(base, settings["metadata"])
+    timings["metadata"] = time.perf_counter() - t
+
+    core.clear_logo_cache()
+    logo_w = int(base.width * settings["scale"] / 100)
+    t = time.perf_counter()
+    core.get_prepared_logo(logo_path, logo_w, settings["opacity"])
+    timings["logo_prep"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    if base.mode != "RGB":
+        base = base.convert("RGB")
+    timings["convert"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    core.apply_logo(
+        base, logo_path, layout if layout != "tiled" else "bottom-right",
+        settings["scale"], settings["opacity"], layout == "tiled",
+        settings["tile_spacing"]
+    )
+    timings["composite"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    core.encode_image(base, io.BytesIO(), settings["output_format"], settings, metadata)
+    timings["encode"] = time.perf_counter() - t
+    return timings
+
+def run_case(case):
+    settings = dict(core.DEFAULT_SETTINGS, **case["settings"])
+    samples = {}
+    totals = []
+    for _ in range(case["iterations"]):
+        for image_path in case["images"]:
+            timings = time_image(image_path, case["logo"], case["layout"], settings)
+            for stage, seconds in timings.items():
+                samples.setdefault(stage, []).append(seconds)
+            totals.append(sum(timings.values()))
+    return {
+        "name": case["name"],
+        "megapixels": case["megapixels"],
+        "input_format": case["input_format"],
+        "logo": case["logo_kind"],
+        "layout": case["layout"],
+        "images": len(totals),
+        "images_per_sec": round(len(totals) / sum(totals), 3),
+        "stages_ms": {stage: percentiles(values) for stage, values in samples.items()},
+        "total_ms": percentiles(totals),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_pipeline(args):
+    ctx = multiprocessing.get_context("spawn")
+    corpus_args = (args.corpus, args.sizes, args.formats, args.count)
+    if args.in_process:
+        images, logos = build_corpus(*corpus_args)
+    else:
+        # Linux carries the peak RSS of a parent across fork and exec, so
+        # the large synthetic images are generated outside this process.
+        with ctx.Pool(1) as pool:
+            images, logos = pool.apply(build_corpus, corpus_args)
+    cases = []
+    for (mp, fmt), paths in images.items():
+        for logo_kind in args.logos:
+            for layout in args.layouts:
+                cases.append({
+                    "name": f"{mp}mp-{fmt}-{logo_kind}-{layout}",
+                    "megapixels": mp,
+                    "input_format": fmt,
+                    "logo_kind": logo_kind,
+                    "logo": logos[logo_kind],
+                    "layout": layout,
+                    "images": paths,
+                    "iterations": args.iterations,
+                    "settings": {"scale": args.scale, "opacity": args.opacity, "output_format": args.output_format,
+                                 "metadata": args.metadata}
+                })
+
+    if args.in_process:
+        results = [run_case(case) for case in cases]
+    else:
+        # A fresh process per case keeps peak RSS attributable to that case.
+        with ctx.Pool(1, maxtasksperchild=1) as pool:
+            results = pool.map(run_case, cases, chunksize=1)
+
+    return {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pillow": Image.__version__,
+        "platform": platform.platform(),
+        "cases": results
+    }
+
+# === Startup ===
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+STARTUP_TARGETS = {
+    # Fresh interpreter, import only: what every spawned batch worker pays.
+    "core": [sys.executable, "-c", "import core"],
+    # Baseline for the above: Pillow with every format plugin registered.
+    "pillow-all-plugins": [sys.executable, "-c", "from PIL import Image; Image.init()"],
+    "cli": [sys.executable, "-c", "import cli"],
+    "gui-import": [sys.executable, "-c", "import gui"],
+    # Window built and drawn, then closed (needs a display).
+    "app": [sys.executable, "watermarker.py", "--startup-probe"],
+}
+
+def time_startup(command, runs):
+    samples = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        proc = subprocess.run(command, cwd=HERE, capture_output=True, text=True)
+        elapsed = time.perf_counter() - t
+        if proc.returncode != 0:
+            lines = (proc.stderr or proc.stdout).strip().splitlines()
+            return {"error": lines[-1] if lines else f"exit code {proc.returncode}"}
+        samples.append(elapsed)
+    result = percentiles(samples, (50, 90))
+    result["min"] = round(min(samples) * 1000, 3)
+    return result
+
+def run_startup(args):
+    targets = {name: STARTUP_TARGETS[name] for name in args.targets}
+    if args.exe:
+        targets["exe"] = [os.path.abspath(args.exe), "--startup-probe"]
+    return {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pillow": Image.__version__,
+        "platform": platform.platform(),
+        "runs": args.runs,
+        "startup_ms": {name: time_startup(command, args.runs) for name, command in targets.items()}
+    }
+
+# === Blend Backends ===
+def max_difference(a, b):
+    # Largest per-channel difference between two images of the same size.
+    diff = ImageChops.difference(a, b)
+    return max(high for low, high in diff.getextrema())
+
+def time_blend(base, logo_path, layout, blend, settings, iterations):
+    # Steady state of a batch: the plan (and the premultiplied layer) is
+    # built by a first call, then only compositing is timed.
+    kwargs = {"repeat_logo": layout == "tiled", "tile_spacing": settings["tile_spacing"],
+              "rotation": settings["rotation"], "blend": blend}
+    position = layout if layout != "tiled" else "bottom-right"
+    core.clear_logo_cache()
+    prep = time.perf_counter()
+    result = core.apply_logo(base.copy(), logo_path, position, settings["scale"], settings["opacity"], **kwargs)
+    prep = time.perf_counter() - prep
+    samples = []
+    for _ in range(iterations):
+        image = base.copy()
+        t = time.perf_counter()
+        core.apply_logo(image, logo_path, position, settings["scale"], settings["opacity"], **kwargs)
+        samples.append(time.perf_counter() - t)
+    return result, {"first_ms": round(prep * 1000, 3), "composite_ms": percentiles(samples, (50, 90))}
+
+def run_blend(args):
+    images, logos = build_corpus(args.corpus, args.sizes, ["png"], 1)
+    settings = dict(core.DEFAULT_SETTINGS, scale=args.scale, opacity=args.opacity, rotation=args.rotation)
+    cases = []
+    for mp in args.sizes:
+        base = Image.open(images[(mp, "png")][0]).convert("RGB")
+        for logo_kind in args.logos:
+            for layout in args.layouts:
+                reference, _ = time_blend(base, logos[logo_kind], layout, "pillow", settings, 1)
+                case = {"name": f"{mp}mp-{logo_kind}-{layout}", "megapixels": mp, "logo": logo_kind, "layout": layout}
+                for blend in args.blends:
+                    result, timing = time_blend(base, logos[logo_kind], layout, blend, settings, args.iterations)
+                    timing["max_diff"] = max_difference(reference, result)
+                    case[blend] = timing
+                cases.append(case)
+    return {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pillow": Image.__version__,
+        "platform": platform.platform(),
+        "cases": cases
+    }
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = {c["name"]: c for c in json.load(f)["cases"]}
+    with open(new_path) as f:
+        new = {c["name"]: c for c in json.load(f)["cases"]}
+    print(f"{'case':40} {'old img/s':>10} {'new img/s':>10} {'change':>8}")
+    for name in sorted(set(old) & set(new)):
+        before, after = old[name]["images_per_sec"], new[name]["images_per_sec"]
+        print(f"{name:40} {before:10.2f} {after:10.2f} {(after / before - 1) * 100:+7.1f}%")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Watermark pipeline benchmarks.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    pipeline = sub.add_parser("pipeline", help="Time each pipeline stage on a synthetic corpus.")
+    pipeline.add_argument("--corpus", default="bench_corpus", help="Where synthetic images are generated and reused.")
+    pipeline.add_argument("--sizes", type=float, nargs="+", default=[1, 12, 24, 50], help="Image sizes in megapixels.")
+    pipeline.add_argument("--formats", nargs="+", default=["jpeg", "png"], choices=["jpeg", "png"])
+    pipeline.add_argument("--logos", nargs="+", default=["opaque", "transparent"], choices=["opaque", "transparent"])
+    pipeline.add_argument("--layouts", nargs="+", default=list(LAYOUTS), choices=LAYOUTS)
+    pipeline.add_argument("--count", type=int, default=2, help="Distinct images per size and format.")
+    pipeline.add_argument("--iterations", type=int, default=3)
+    pipeline.add_argument("--scale", type=float, default=20)
+    pipeline.add_argument("--opacity", type=float, default=70)
+    pipeline.add_argument("--output-format", default="jpeg", choices=[f for f in core.OUTPUT_FORMATS if f != "same"])
+    pipeline.add_argument("--metadata", default="icc", choices=core.METADATA_POLICIES,
+                          help="What to carry from source to output; JPEG sources have a profile and EXIF.")
+    pipeline.add_argument("--in-process", action="store_true", help="Run every case in this process.")
+    pipeline.add_argument("-o", "--output", help="Write JSON results here instead of stdout.")
+
+    startup = sub.add_parser("startup", help="Time cold starts in fresh processes.")
+    startup.add_argument("--targets", nargs="+", default=list(STARTUP_TARGETS), choices=list(STARTUP_TARGETS))
+    startup.add_argument("--exe", help="Also time a built bundle, e.g. dist/watermarker/watermarker.exe.")
+    startup.add_argument("--runs", type=int, default=10)
+    startup.add_argument("-o", "--output", help="Write JSON results here instead of stdout.")
+
+    blend = sub.add_parser("blend", help="Time the compositing backends against each other.")
+    blend.add_argument("--corpus", default="bench_corpus", help="Where synthetic images are generated and reused.")
+    blend.add_argument("--sizes", type=float, nargs="+", default=[1, 12, 24], help="Image sizes in megapixels.")
+    blend.add_argument("--logos", nargs="+", default=["opaque", "transparent"], choices=["opaque", "transparent"])
+    blend.add_argument("--layouts", nargs="+", default=["bottom-right", "center", "tiled"], choices=LAYOUTS)
+    blend.add_argument("--blends", nargs="+", default=list(BLEND_MODES), choices=BLEND_MODES)
+    blend.add_argument("--iterations", type=int, default=10)
+    blend.add_argument("--scale", type=float, default=20)
+    blend.add_argument("--opacity", type=float, default=70)
+    blend.add_argument("--rotation", type=float, default=0)
+    blend.add_argument("-o", "--output", help="Write JSON results here instead of stdout.")
+
+    diff = sub.add_parser("compare", help="Compare two result files.")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "compare":
+        compare(args.old, args.new)
+        return 0
+
+    runners = {"pipeline": run_pipeline, "startup": run_startup, "blend": run_blend}
+    results = runners[args.command](args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import importlib.util
+
+from PIL import Image
+
+# NumPy is optional and only imported by the first NumPy blend: it would
+# otherwise add to the start-up of every spawned batch worker.
+np = None
+
+# "pillow" composites with Image.paste and a mask. "numpy" does the same
+# gamma-space blend on NumPy arrays from a premultiplied layer; "linear"
+# blends the colour channels in linear light, which keeps light logos on
+# dark photos from looking thin and dark-edged.
+BLEND_MODES = ("pillow", "numpy", "linear")
+
+# sRGB <-> linear tables. Encoding goes through 4096 linear steps, which
+# is finer than one 8-bit level everywhere on the sRGB curve.
+LINEAR_STEPS = 4095
+
+def numpy_available():
+    return np is not None or importlib.util.find_spec("numpy") is not None
+
+def _load_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ValueError("The numpy and linear blends need NumPy (pip install numpy).")
+        np = numpy
+    return np
+
+def _srgb_tables():
+    # to_linear gives linear light in steps (0-LINEAR_STEPS), so a blended
+    # value indexes to_srgb after one truncation.
+    levels = np.arange(256, dtype=np.float64) / 255
+    to_linear = np.where(levels <= 0.04045, levels / 12.92, ((levels + 0.055) / 1.055) ** 2.4)
+    steps = np.arange(LINEAR_STEPS + 1, dtype=np.float64) / LINEAR_STEPS
+    to_srgb = np.where(steps <= 0.0031308, steps * 12.92, 1.055 * steps ** (1 / 2.4) - 0.055)
+    return (to_linear * LINEAR_STEPS).astype(np.float32), np.round(to_srgb * 255).astype(np.uint8)
+
+_tables = None
+
+def srgb_tables():
+    global _tables
+    if _tables is None:
+        _tables = _srgb_tables()
+    return _tables
+
+def prepare_layer(layer, linear=False, opacity=1.0):
+    # Premultiplies an unfaded RGBA layer once per layout plan, with
+    # opacity (0-1) folded into its alpha as one scalar multiply, so a
+    # blend is one multiply-add per pixel: out = premul + base * (255 - alpha) / 255.
+    _load_numpy()
+    bbox = layer.getchannel("A").getbbox()
+    if bbox is None or opacity <= 0:
+        return None
+    rgba = np.array(layer.crop(bbox), dtype=np.uint16)
+    if opacity < 1:
+        # Truncated in float32 as Pillow's fade is, so the two paths agree.
+        rgba[..., 3] = rgba[..., 3].astype(np.float32) * np.float32(opacity)
+    alpha = rgba[..., 3:4].copy()
+    rgba *= alpha
+    rgba += 127
+    rgba //= 255
+    premul = rgba.astype(np.uint8)
+    prepared = {"bbox": bbox, "premul": premul, "inv": 255 - alpha}
+    if linear:
+        to_linear, _ = srgb_tables()
+        coverage = alpha.astype(np.float32) / 255
+        # The + 0.5 rounds to the nearest step when the blend truncates.
+        prepared["premul_linear"] = to_linear[np.asarray(layer.crop(bbox))[..., :3]] * coverage + 0.5
+        prepared["inv_linear"] = 1 - coverage
+    return prepared
+
+def _blend_gamma(view, premul, inv):
+    # (x * inv + 128 + ((x * inv + 128) >> 8)) >> 8 is x * inv / 255 rounded,
+    # without a division, and stays inside uint16.
+    out = view * inv
+    out += 128
+    out += out >> 8
+    out >>= 8
+    out += premul
+    view[...] = out
+
+def _blend_linear(view, premul, inv):
+    to_linear, to_srgb = srgb_tables()
+    # np.take is a good deal faster than fancy indexing for table lookups.
+    out = np.take(to_linear, view)
+    out *= inv
+    out += premul
+    view[...] = np.take(to_srgb, out.astype(np.int32))
+
+def blend_layer(base, prepared, positions, linear=False):
+    # Blends the prepared layer into base in place at each position. Only
+    # the layer's opaque bounding box is read and written back: a tiled
+    # layout goes one row of tiles at a time, each row one strip the
+    # height of the layer, so it never builds a full-canvas overlay and
+    # crops and pastes once per row rather than once per tile.
+    if prepared is None:
+        return base
+    bands = len(base.getbands())
+    x0, y0, x1, y1 = prepared["bbox"]
+    rows = {}
+    for x, y in positions:
+        rows.setdefault(y, []).append(x)
+    for y, columns in rows.items():
+        top, bottom = max(0, y + y0), min(base.height, y + y1)
+        left, right = max(0, min(columns) + x0), min(base.width, max(columns) + x1)
+        if top >= bottom or left >= right:
+            continue
+        strip = np.array(base.crop((left, top, right, bottom)))
+        layer_rows = slice(top - y - y0, bottom - y - y0)
+        for x in columns:
+            start, stop = max(left, x + x0), min(right, x + x1)
+            if start >= stop:
+                continue
+            region = strip[:, start - left:stop - left]
+            layer_cols = slice(start - x - x0, stop - x - x0)
+            premul = prepared["premul"][layer_rows, layer_cols, :bands]
+            inv = prepared["inv"][layer_rows, layer_cols]
+            if linear:
+                _blend_linear(region[..., :3], prepared["premul_linear"][layer_rows, layer_cols],
+                              prepared["inv_linear"][layer_rows, layer_cols])
+                if bands == 4:
+                    _blend_gamma(region[..., 3:], premul[..., 3:], inv)
+            else:
+                _blend_gamma(region, premul, inv)
+        base.paste(Image.fromarray(strip, base.mode), (left, top))
+    return base
@@ -0,0 +1,360 @@
+import os
+import sys
+import glob
+import time
+import json
+import signal
+import argparse
+
+from core import (
+    read_settings, parse_rendition, text_segments, SETTINGS_FILE, POSITIONS, OUTPUT_FORMATS, JPEG_SUBSAMPLING,
+    WATERMARK_TYPES, METADATA_POLICIES
+)
+from batch import BatchJob, default_workers, resume_job
+from blend import BLEND_MODES, numpy_available
+from journal import JobJournal, journal_path_for
+from ingest import iter_images
+from dedupe import DuplicateIndex, DEDUPE_MODES
+from watch import WatchJob, DEBOUNCE_S
+
+def expand_inputs(patterns, recursive=False):
+    roots = []
+    for pattern in patterns:
+        if os.path.exists(pattern):
+            roots.append(pattern)
+        else:
+            roots.extend(sorted(glob.glob(pattern, recursive=recursive)))
+    return roots
+
+def collect_inputs(patterns, recursive=False, on_found=None):
+    # on_found(paths) sees each image as the walk reaches it, e.g. to
+    # start hashing while the rest of the tree is still being listed.
+    paths = []
+    for path in iter_images(expand_inputs(patterns, recursive), recursive):
+        paths.append(path)
+        if on_found is not None:
+            on_found((path,))
+    return paths
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="watermarker", description="Headless AUSVIC logo watermarking.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    batch = sub.add_parser("batch", help="Watermark a set of images.")
+    batch.add_argument("inputs", nargs="+", help="Image files, folders or glob patterns.")
+    batch.add_argument("--settings", default=SETTINGS_FILE, help="Settings file used for defaults.")
+    batch.add_argument("--logo", dest="logo_path", help="PNG logo to apply.")
+    batch.add_argument("-o", "--output-dir", dest="output_dir", help="Directory for watermarked images.")
+    batch.add_argument("--type", dest="watermark_type", choices=WATERMARK_TYPES,
+                       help="Stamp the logo or a line of text.")
+    batch.add_argument("--text",
+                       help="Text watermark; {filename} and {sku} are filled in per image. Implies --type text.")
+    batch.add_argument("--font", dest="text_font",
+                       help="TrueType/OpenType font for text (default: Pillow's built-in font).")
+    batch.add_argument("--text-size", dest="text_size", type=float, help="Text height as %% of the shorter image edge.")
+    batch.add_argument("--text-color", dest="text_color", help="Text colour, e.g. white or '#ff0000'.")
+    batch.add_argument("--stroke-width", dest="text_stroke_width", type=int, help="Outline width around text in px.")
+    batch.add_argument("--stroke-color", dest="text_stroke_color", help="Outline colour.")
+    batch.add_argument("--sku-pattern", dest="sku_pattern", help="Regex that picks {sku} out of the file name.")
+    batch.add_argument("--position", choices=POSITIONS)
+    batch.add_argument("--scale", type=float, help="Logo width as %% of image width.")
+    batch.add_argument("--opacity", type=float, help="Logo opacity in %%.")
+    batch.add_argument("--rotation", type=float, help="Turn the logo or text counter-clockwise by this many degrees.")
+    batch.add_argument("--padding", type=float,
+                       help="Gap to the anchored edges as %% of the shorter edge (default 10 px).")
+    batch.add_argument("--offset", type=float, nargs=2, metavar=("X", "Y"),
+                       help="Move the watermark from its anchor by %% of the image width and height.")
+    batch.add_argument("--blend", choices=BLEND_MODES,
+                       help="Compositing: Pillow (default), the same blend on NumPy, or NumPy in linear light.")
+    batch.add_argument("--repeat", dest="repeat_logo", action="store_true", default=None,
+                       help="Tile the logo across the image.")
+    batch.add_argument("--no-repeat", dest="repeat_logo", action="store_false", help="Place a single logo.")
+    batch.add_argument("--tile-spacing", dest="tile_spacing", type=int, help="Gap between tiled logos in px.")
+    batch.add_argument("--tile-offset", dest="tile_offset", type=int, nargs=2, metavar=("X", "Y"),
+                       help="Shift of the tile grid in px.")
+    batch.add_argument("--format", dest="output_format", choices=OUTPUT_FORMATS,
+                       help="Output format; 'same' keeps the input format.")
+    batch.add_argument("--quality", type=int, help="Lossy quality for JPEG, WebP and AVIF (1-100).")
+    batch.add_argument("--subsampling", dest="jpeg_subsampling", choices=JPEG_SUBSAMPLING,
+                       help="JPEG chroma subsampling.")
+    batch.add_argument("--optimize", dest="jpeg_optimize", action="store_true", default=None,
+                       help="Optimize JPEG Huffman tables.")
+    batch.add_argument("--progressive", dest="jpeg_progressive", action="store_true", default=None,
+                       help="Write progressive JPEG.")
+    batch.add_argument("--lossless", dest="webp_lossless", action="store_true", default=None,
+                       help="Write lossless WebP.")
+    batch.add_argument("--webp-method", dest="webp_method", type=int, choices=range(7),
+                       help="WebP effort, 0 (fast) to 6 (small).")
+    batch.add_argument("--avif-speed", dest="avif_speed", type=int, choices=range(11),
+                       help="AVIF speed, 0 (small) to 10 (fast).")
+    batch.add_argument("--metadata", choices=METADATA_POLICIES,
+                       help="Copy the ICC profile and EXIF ('keep'), only the profile ('icc', default) or neither.")
+    batch.add_argument("--rendition", dest="renditions", type=parse_rendition, action="append",
+                       metavar="NAME:SIZE[:SCALE]",
+                       help="Also write a copy with its longest edge at SIZE px, with an optional logo scale. Repeatable.")
+    batch.add_argument("-j", "--workers", type=int, help=f"Parallel worker processes (default {default_workers()}).")
+    batch.add_argument("--memory-budget", dest="memory_budget_mb", type=float,
+                       help="MB an image may use before tiled compositing switches to bands.")
+    batch.add_argument("--max-megapixels", dest="max_megapixels", type=float,
+                       help="Largest image accepted, in megapixels (0 disables the check).")
+    batch.add_argument("--dedupe", choices=DEDUPE_MODES,
+                       help="Encode identical sources once: by file content, or also by perceptual hash for re-encodes.")
+    batch.add_argument("--copy-duplicates", dest="dedupe_link", action="store_false", default=None,
+                       help="Copy outputs for duplicates instead of hardlinking them.")
+    batch.add_argument("--force", action="store_true", help="Reprocess images even if their output is up to date.")
+    batch.add_argument("--hash-sources", dest="manifest_check", action="store_const", const="hash",
+                       help="Detect changed sources by content hash instead of size and mtime.")
+    batch.add_argument("--timings", dest="instrument", action="store_true", default=None,
+                       help="Time each stage and write a JSONL log to the output directory.")
+    batch.add_argument("--profile", action="store_true", default=None,
+                       help="Run in one process under cProfile and dump the stats to the output directory.")
+    batch.add_argument("--schedule", choices=("size", "input"),
+                       help="Process images grouped by dimensions (default) or in the order given.")
+    batch.add_argument("--io-threads", dest="io_threads", type=int, help="Reader and writer threads each (default 4).")
+    batch.add_argument("-r", "--recursive", action="store_true", help="Descend into sub-folders.")
+    batch.add_argument("--report", help="Write the JSON report here instead of stdout.")
+    batch.add_argument("--progress", action="store_true", help="Print progress to stderr.")
+    batch.add_argument("--no-journal", dest="journal", action="store_false",
+                       help="Do not record the job for resuming after a crash.")
+    batch.add_argument("--watch", action="store_true",
+                       help="Keep watching the input folders and watermark images as they arrive, until Ctrl+C.")
+    batch.add_argument("--poll", action="store_true", help="With --watch, poll the folders instead of using inotify.")
+    batch.add_argument("--debounce", type=float, default=DEBOUNCE_S,
+                       help=f"With --watch, seconds a file must stay unchanged before it is read (default {DEBOUNCE_S}).")
+
+    resume = sub.add_parser("resume", help="Finish an interrupted batch from the job journal.")
+    resume.add_argument("job_id", type=int, nargs="?", help="Job to resume (default: the most recent unfinished one).")
+    resume.add_argument("--settings", default=SETTINGS_FILE, help="Settings file the journal sits next to.")
+    resume.add_argument("-j", "--workers", type=int, help="Parallel worker processes (default: as when started).")
+    resume.add_argument("--report", help="Write the JSON report here instead of stdout.")
+    resume.add_argument("--progress", action="store_true", help="Print progress to stderr.")
+
+    jobs = sub.add_parser("jobs", help="List unfinished batches in the job journal.")
+    jobs.add_argument("--settings", default=SETTINGS_FILE, help="Settings file the journal sits next to.")
+
+    service = sub.add_parser("serve", help="Run a local HTTP watermarking service.")
+    service.add_argument("--settings", default=SETTINGS_FILE, help="Settings file used for defaults.")
+    service.add_argument("--logo", dest="logo_path", help="PNG logo to apply.")
+    service.add_argument("-o", "--output-dir", dest="output_dir", help="Directory POST /batch writes to.")
+    service.add_argument("--host", default="127.0.0.1", help="Interface to bind (default: localhost only).")
+    service.add_argument("--port", type=int, default=8765)
+    service.add_argument("-j", "--workers", type=int, help=f"Worker processes kept warm (default {default_workers()}).")
+    service.add_argument("--max-pending", type=int,
+                         help="Single-image requests in flight before answering 503 (default 2 per worker).")
+    service.add_argument("--max-upload-mb", type=float, default=200, help="Largest accepted upload.")
+    service.add_argument("--quiet", action="store_true", help="Do not log each request.")
+    return parser
+
+# Batch options copied into the settings when given on the command line.
+OVERRIDE_KEYS = (
+    "logo_path", "output_dir", "watermark_type",
+    "text", "text_font", "text_size", "text_color", "text_stroke_width", "text_stroke_color", "sku_pattern",
+    "position", "scale", "opacity", "rotation", "padding", "blend", "repeat_logo", "tile_spacing",
+    "output_format", "quality", "jpeg_subsampling", "jpeg_optimize", "jpeg_progressive",
+    "webp_lossless", "webp_method", "avif_speed", "metadata", "renditions",
+    "manifest_check", "instrument", "profile", "schedule", "dedupe", "dedupe_link",
+    "memory_budget_mb", "max_megapixels", "io_threads", "workers"
+)
+
+def resolve_settings(args):
+    settings = read_settings(args.settings)
+    for key in OVERRIDE_KEYS:
+        value = getattr(args, key, None)
+        if value is not None:
+            settings[key] = value
+    if args.tile_offset:
+        settings["tile_offset_x"], settings["tile_offset_y"] = args.tile_offset
+    if args.offset:
+        settings["offset_x"], settings["offset_y"] = args.offset
+    if args.text is not None and args.watermark_type is None:
+        settings["watermark_type"] = "text"
+    return settings
+
+def write_report(report, path=None):
+    text = json.dumps(report, indent=4)
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+def run_batch(args):
+    try:
+        settings = resolve_settings(args)
+    except (OSError, ValueError) as e:
+        write_report({"status": "error", "error": f"Failed to load settings: {e}"}, args.report)
+        return 2
+
+    problems = []
+    if settings.get("watermark_type", "logo") == "text":
+        try:
+            if not text_segments(settings.get("text", "")):
+                problems.append("No watermark text given.")
+        except ValueError as e:
+            problems.append(str(e))
+        if settings.get("text_font") and not os.path.isfile(settings["text_font"]):
+            problems.append(f"Font not found: {settings['text_font']!r}")
+    elif not settings["logo_path"] or not os.path.isfile(settings["logo_path"]):
+        problems.append(f"Logo not found: {settings['logo_path']!r}")
+    if settings.get("blend", "pillow") != "pillow" and not numpy_available():
+        problems.append(f"The {settings['blend']} blend needs NumPy (pip install numpy).")
+    if not settings["output_dir"]:
+        problems.append("No output directory given.")
+    if args.watch:
+        missing = [path for path in args.inputs if not os.path.isdir(path)]
+        if missing:
+            problems.append(f"--watch needs folders: {', '.join(map(repr, missing))}")
+        if problems:
+            write_report({"status": "error", "error": " ".join(problems)}, args.report)
+            return 2
+        return run_watch(args, settings)
+    # Images found inside a folder keep their sub-folder in the output.
+    settings["input_roots"] = [os.path.abspath(path) for path in expand_inputs(args.inputs, args.recursive)
+                               if os.path.isdir(path)]
+    duplicates = None
+    if settings.get("dedupe", "off") != "off":
+        duplicates = DuplicateIndex()
+        image_paths = collect_inputs(args.inputs, args.recursive,
+                                     lambda paths: duplicates.add(paths, settings["dedupe"]))
+    else:
+        image_paths = collect_inputs(args.inputs, args.recursive)
+    if not image_paths:
+        problems.append("No input images matched.")
+    if problems:
+        if duplicates is not None:
+            duplicates.close()
+        write_report({"status": "error", "error": " ".join(problems)}, args.report)
+        return 2
+
+    os.makedirs(settings["output_dir"], exist_ok=True)
+    journal = JobJournal(journal_path_for(args.settings)) if args.journal else None
+    try:
+        return run_job(BatchJob(image_paths, settings, force=args.force, journal=journal, duplicates=duplicates), args)
+    finally:
+        if duplicates is not None:
+            duplicates.close()
+
+def run_job(job, args):
+    if args.progress:
+        job.start()
+        while True:
+            kind, done, total = job.events.get()
+            if kind == "finished":
+                break
+            print(f"{done}/{total}", file=sys.stderr)
+    else:
+        job.run()
+
+    report = {
+        "status": "ok" if not job.errors else "partial",
+        "job_id": job.job_id,
+        "total": job.total,
+        "processed": job.done - len(job.skipped) - len(job.deduplicated),
+        "skipped": len(job.skipped),
+        "duplicates": len(job.deduplicated),
+        "encodes_saved": job.encodes_saved,
+        "failed": len(job.errors),
+        "errors": [{"path": path, "error": msg} for path, msg in job.errors],
+        "size_groups": len(job.size_groups),
+        "stats": job.stats.summary()
+    }
+    write_report(report, args.report)
+    return 0 if not job.errors else 1
+
+def run_watch(args, settings):
+    # One NDJSON line per batch on stdout (or appended to --report) until
+    # Ctrl+C or SIGTERM; --force is ignored, the manifest decides.
+    def report_batch(job):
+        line = json.dumps({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "job_id": job.job_id,
+            "processed": job.done - len(job.skipped) - len(job.deduplicated),
+            "skipped": len(job.skipped),
+            "duplicates": len(job.deduplicated),
+            "failed": len(job.errors),
+            "errors": [{"path": path, "error": msg} for path, msg in job.errors]
+        })
+        if args.report:
+            with open(args.report, "a") as f:
+                f.write(line + "\n")
+        else:
+            print(line, flush=True)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    os.makedirs(settings["output_dir"], exist_ok=True)
+    journal = JobJournal(journal_path_for(args.settings)) if args.journal else None
+    watch = WatchJob(args.inputs, settings, recursive=args.recursive, debounce=args.debounce, polling=args.poll,
+                     journal=journal, on_batch=report_batch)
+    previous = signal.signal(signal.SIGTERM, stop)
+    watch.start()
+    try:
+        kind, detail = watch.events.get()
+        if kind == "watching":
+            print(f"Watching {', '.join(watch.roots)} ({detail}); Ctrl+C to stop.", file=sys.stderr)
+        while watch.is_running():
+            watch.join(0.5)
+    except KeyboardInterrupt:
+        watch.cancel()
+        watch.join()
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        if journal is not None:
+            journal.close()
+    print(f"Stopped after {watch.batches} batches, {watch.processed} images.", file=sys.stderr)
+    return 0 if not watch.errors else 1
+
+def run_resume(args):
+    journal = JobJournal(journal_path_for(args.settings))
+    job_id = args.job_id
+    if job_id is None:
+        unfinished = journal.resumable()
+        if not unfinished:
+            write_report({"status": "error", "error": "No unfinished jobs."}, args.report)
+            return 2
+        job_id = unfinished[0][0]
+    try:
+        job = resume_job(journal, job_id, args.workers)
+    except (KeyError, RuntimeError) as e:
+        write_report({"status": "error", "error": str(e.args[0])}, args.report)
+        return 2
+    return run_job(job, args)
+
+def run_jobs(args):
+    journal = JobJournal(journal_path_for(args.settings))
+    write_report([
+        {"job_id": job_id, "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(created)),
+         "remaining": remaining, "total": total}
+        for job_id, created, remaining, total in journal.resumable()
+    ])
+    return 0
+
+def run_serve(args):
+    try:
+        settings = read_settings(args.settings)
+    except (OSError, ValueError) as e:
+        print(f"Failed to load settings: {e}", file=sys.stderr)
+        return 2
+    if args.logo_path:
+        settings["logo_path"] = args.logo_path
+    if args.output_dir:
+        settings["output_dir"] = args.output_dir
+    # http.server and its email/html dependencies are only needed here.
+    from service import serve
+    return serve(settings, args.host, args.port, args.workers, args.max_pending, args.max_upload_mb, args.quiet)
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "batch":
+        return run_batch(args)
+    if args.command == "resume":
+        return run_resume(args)
+    if args.command == "jobs":
+        return run_jobs(args)
+    if args.command == "serve":
+        return run_serve(args)
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
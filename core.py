@@ -0,0 +1,864 @@
+import io
+import os
+import re
+import json
+import time
+import string
+import tempfile
+import importlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from PIL import Image, ImageChops, ImageColor, ImageDraw, ImageEnhance, ImageFont, ImageOps
+
+from blend import BLEND_MODES, prepare_layer, blend_layer
+
+SETTINGS_FILE = "settings.json"
+
+DEFAULT_SETTINGS = {
+    "logo_path": "",
+    "output_dir": "",
+    "position": "bottom-right",
+    "scale": 20,
+    "opacity": 100,
+    "rotation": 0,
+    "padding": None,
+    "offset_x": 0,
+    "offset_y": 0,
+    "blend": "pillow",
+    "watermark_type": "logo",
+    "text": "",
+    "text_font": "",
+    "text_size": 5,
+    "text_color": "#ffffff",
+    "text_stroke_width": 0,
+    "text_stroke_color": "#000000",
+    "sku_pattern": "^[A-Za-z0-9-]+",
+    "repeat_logo": False,
+    "tile_spacing": 50,
+    "tile_offset_x": 0,
+    "tile_offset_y": 0,
+    "output_format": "jpeg",
+    "quality": 75,
+    "jpeg_subsampling": "4:2:0",
+    "jpeg_optimize": False,
+    "jpeg_progressive": False,
+    "webp_lossless": False,
+    "webp_method": 4,
+    "avif_speed": 6,
+    "metadata": "icc",
+    "manifest_check": "stat",
+    "instrument": False,
+    "profile": False,
+    "memory_budget_mb": 512,
+    "max_megapixels": 1000,
+    "io_threads": 4,
+    "schedule": "size",
+    "dedupe": "off",
+    "dedupe_link": True,
+    "renditions": [],
+    "input_roots": []
+}
+
+# === Pillow Plugins ===
+# Only the formats this app reads and writes. Left alone, the first WebP,
+# TIFF or AVIF file makes Pillow import all of its ~45 format plugins.
+# MPO is kept because phone JPEGs with a depth map open through it.
+PIL_PLUGINS = ("JpegImagePlugin", "MpoImagePlugin", "PngImagePlugin", "WebPImagePlugin", "TiffImagePlugin")
+
+def load_plugins():
+    for name in PIL_PLUGINS:
+        importlib.import_module(f"PIL.{name}")
+    try:
+        importlib.import_module("PIL.AvifImagePlugin")  # Pillow 11.3+
+    except ImportError:
+        try:
+            importlib.import_module("pillow_avif")
+        except ImportError:
+            pass
+
+load_plugins()
+
+# The formats registered above. Opening a batch input with formats= set
+# to these keeps a corrupt file from making Pillow import every other
+# plugin to identify it; uploads to the service are opened unrestricted.
+READ_FORMATS = tuple(fmt for fmt in ("JPEG", "MPO", "PNG", "WEBP", "TIFF", "AVIF") if fmt in Image.OPEN)
+
+POSITIONS = ("top-left", "top-center", "top-right", "center-left", "center", "center-right",
+             "bottom-left", "bottom-center", "bottom-right")
+WATERMARK_TYPES = ("logo", "text")
+
+def read_settings(path=SETTINGS_FILE):
+    settings = dict(DEFAULT_SETTINGS)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            settings.update(json.load(f))
+    return settings
+
+# === Caches ===
+class LRUCache:
+    # Shared by the GUI preview and an in-process batch thread.
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+# === Prepared Logo Cache ===
+LOGO_CACHE_SIZE = 16
+OVERLAY_CACHE_SIZE = 4
+_logo_cache = LRUCache(LOGO_CACHE_SIZE)
+_resized_cache = LRUCache(LOGO_CACHE_SIZE)
+_overlay_cache = LRUCache(OVERLAY_CACHE_SIZE)
+_rotated_cache = LRUCache(LOGO_CACHE_SIZE)
+_logo_source = {}
+_logo_source_lock = threading.Lock()
+
+def load_logo(logo_path):
+    mtime = os.path.getmtime(logo_path)
+    key = (logo_path, mtime)
+    with _logo_source_lock:
+        source = _logo_source.get(key)
+        if source is None:
+            source = Image.open(logo_path).convert("RGBA")
+            _logo_source.clear()
+            _logo_source[key] = source
+    return source, mtime
+
+def get_resized_logo(logo_path, logo_w):
+    source, mtime = load_logo(logo_path)
+    key = (logo_path, mtime, logo_w)
+    logo = _resized_cache.get(key)
+    if logo is not None:
+        return logo
+
+    logo_h = int(logo_w * (source.height / source.width))
+    logo = source.resize((logo_w, logo_h), Image.Resampling.LANCZOS)
+    return _resized_cache.put(key, logo)
+
+_opacity_tables = LRUCache(LOGO_CACHE_SIZE)
+
+def fade_layer(layer, opacity_percent):
+    # Scales an RGBA layer's alpha in one lookup pass. The table is what
+    # ImageEnhance.Brightness gives on the alpha band, so the result is
+    # unchanged, without the split, enhance and putalpha copies.
+    if opacity_percent >= 100:
+        return layer
+    table = _opacity_tables.get(opacity_percent)
+    if table is None:
+        ramp = Image.frombytes("L", (256, 1), bytes(range(256)))
+        faded = ImageEnhance.Brightness(ramp).enhance(opacity_percent / 100).tobytes()
+        table = _opacity_tables.put(opacity_percent, list(range(256)) * 3 + list(faded))
+    return layer.point(table)
+
+def get_prepared_logo(logo_path, logo_w, opacity_percent):
+    # Resizing and opacity are cached separately, so a new opacity only
+    # rescales the alpha band of an already resampled logo.
+    resized = get_resized_logo(logo_path, logo_w)
+    if opacity_percent >= 100:
+        return resized
+    key = (logo_path, os.path.getmtime(logo_path), logo_w, opacity_percent)
+    logo = _logo_cache.get(key)
+    if logo is not None:
+        return logo
+    return _logo_cache.put(key, fade_layer(resized, opacity_percent))
+
+def get_rotated_layer(layer, layer_key, angle):
+    # Rotation resamples every pixel, so each prepared layer is rotated
+    # once per angle and a batch reuses the result. The turn is done on
+    # premultiplied pixels so the transparent corners bring no dark fringe.
+    angle = angle % 360
+    if not angle:
+        return layer, layer_key
+    key = layer_key + ("rotated", angle)
+    rotated = _rotated_cache.get(key)
+    if rotated is None:
+        rotated = layer.convert("RGBa").rotate(angle, Image.Resampling.BICUBIC, expand=True).convert("RGBA")
+        rotated = _rotated_cache.put(key, rotated)
+    return rotated, key
+
+def clear_logo_cache():
+    _plan_cache.clear()
+    _logo_cache.clear()
+    _resized_cache.clear()
+    _rotated_cache.clear()
+    _overlay_cache.clear()
+    with _logo_source_lock:
+        _logo_source.clear()
+
+# === Tiled Overlay ===
+def _tile_starts(offset, step, limit):
+    start = offset % step
+    if start:
+        start -= step
+    return range(start, limit, step)
+
+def tile_grid(canvas_size, tile_size, spacing=50, offset=(0, 0)):
+    step_x = tile_size[0] + spacing
+    step_y = tile_size[1] + spacing
+    return tuple((x, y) for y in _tile_starts(int(offset[1]), step_y, canvas_size[1])
+                 for x in _tile_starts(int(offset[0]), step_x, canvas_size[0]))
+
+def get_tile_overlay(canvas_size, logo, logo_key, spacing=50, offset=(0, 0), tiles=None):
+    # Tiles never overlap (spacing >= 0), so a plain paste into a clear
+    # layer is exact and the batch pays for one masked paste per image.
+    spacing = max(0, int(spacing))
+    key = (canvas_size, logo_key, spacing, tuple(offset))
+    overlay = _overlay_cache.get(key)
+    if overlay is not None:
+        return overlay
+
+    if tiles is None:
+        tiles = tile_grid(canvas_size, logo.size, spacing, offset)
+    overlay = Image.new("RGBA", canvas_size, (0, 0, 0, 0))
+    for pos in tiles:
+        overlay.paste(logo, pos)
+    return _overlay_cache.put(key, overlay)
+
+# === Layout Plans ===
+# Catalogs come in a handful of standard sizes, so everything about where
+# the layer goes depends only on the canvas size and the settings. One
+# plan per (size, settings) holds the prepared layer and its position or
+# tile grid, and every image of that size reuses it.
+PLAN_CACHE_SIZE = LOGO_CACHE_SIZE
+_plan_cache = LRUCache(PLAN_CACHE_SIZE)
+
+def layout_plan(canvas_size, layer, layer_key, position, repeat=False, tile_spacing=50, tile_offset=(0, 0), margin=10,
+                shift=(0, 0)):
+    # position names the anchor ("top-left" ... "bottom-right"); margin
+    # keeps the layer off the anchored edges and shift moves it from there.
+    base_w, base_h = canvas_size
+    layer_w, layer_h = layer.size
+    plan = {"size": canvas_size, "layer": layer, "layer_key": layer_key, "repeat": repeat,
+            "spacing": max(0, int(tile_spacing)), "offset": tuple(tile_offset), "pos": None, "tiles": None}
+    if repeat:
+        plan["tiles"] = tile_grid(canvas_size, layer.size, plan["spacing"], plan["offset"])
+    else:
+        if position not in POSITIONS:
+            position = "bottom-right"
+        vertical, _, horizontal = position.partition("-")
+        columns = {"left": margin, "center": (base_w - layer_w) // 2, "right": base_w - layer_w - margin}
+        rows = {"top": margin, "center": (base_h - layer_h) // 2, "bottom": base_h - layer_h - margin}
+        plan["pos"] = (columns[horizontal or "center"] + shift[0], rows[vertical] + shift[1])
+    return plan
+
+# === Text Watermark ===
+TEXT_CACHE_SIZE = 256
+_font_cache = LRUCache(LOGO_CACHE_SIZE)
+_segment_cache = LRUCache(TEXT_CACHE_SIZE)
+_text_cache = LRUCache(LOGO_CACHE_SIZE)
+
+def get_font(font_path, size):
+    mtime = os.path.getmtime(font_path) if font_path else None
+    key = (font_path, mtime, size)
+    font = _font_cache.get(key)
+    if font is None:
+        # Without a font file Pillow's bundled FreeType face is used.
+        font = ImageFont.truetype(font_path, size) if font_path else ImageFont.load_default(size)
+        _font_cache.put(key, font)
+    return font, mtime
+
+def get_segment_masks(segment, font_path, size, stroke_width):
+    # Fill and outline coverage of one run of text, drawn on its baseline
+    # so runs rasterized separately line up when placed side by side.
+    font, mtime = get_font(font_path, size)
+    key = (segment, font_path, mtime, size, stroke_width)
+    masks = _segment_cache.get(key)
+    if masks is not None:
+        return masks
+
+    left, top, right, bottom = font.getbbox(segment, anchor="ls", stroke_width=stroke_width)
+    box = (max(1, right - left), max(1, bottom - top))
+    fill = Image.new("L", box, 0)
+    ImageDraw.Draw(fill).text((-left, -top), segment, font=font, fill=255, anchor="ls")
+    outline = fill
+    if stroke_width:
+        outline = Image.new("L", box, 0)
+        ImageDraw.Draw(outline).text((-left, -top), segment, font=font, fill=255, anchor="ls",
+                                     stroke_width=stroke_width, stroke_fill=255)
+    return _segment_cache.put(key, (fill, outline, left, top, font.getlength(segment)))
+
+def _merge_mask(canvas, mask, pos):
+    box = (pos[0], pos[1], pos[0] + mask.width, pos[1] + mask.height)
+    canvas.paste(ImageChops.lighter(canvas.crop(box), mask), box)
+
+def get_text_layer(segments, font_path, size, color, opacity_percent, stroke_width=0, stroke_color="#000000"):
+    # segments is the text split at template fields: literal runs are
+    # rasterized once per batch and only the substituted values are new.
+    segments = tuple(seg for seg in segments if seg)
+    key = (segments, font_path, size, color, opacity_percent, stroke_width, stroke_color)
+    layer = _text_cache.get(key)
+    if layer is not None:
+        return layer, key
+    if not segments:
+        return None, key
+
+    pieces = []
+    x = 0.0
+    for segment in segments:
+        fill, outline, left, top, advance = get_segment_masks(segment, font_path, size, stroke_width)
+        pieces.append((round(x) + left, top, fill, outline))
+        x += advance
+    x0 = min(p[0] for p in pieces)
+    y0 = min(p[1] for p in pieces)
+    box = (max(p[0] + p[2].width for p in pieces) - x0, max(p[1] + p[2].height for p in pieces) - y0)
+    fill_mask = Image.new("L", box, 0)
+    outline_mask = Image.new("L", box, 0) if stroke_width else fill_mask
+    for px, py, fill, outline in pieces:
+        _merge_mask(fill_mask, fill, (px - x0, py - y0))
+        if stroke_width:
+            _merge_mask(outline_mask, outline, (px - x0, py - y0))
+
+    fill_rgb = ImageColor.getrgb(color)[:3]
+    if stroke_width:
+        layer = Image.new("RGBA", box, ImageColor.getrgb(stroke_color)[:3] + (0,))
+        layer.putalpha(outline_mask)
+        layer.paste(fill_rgb + (255,), (0, 0) + box, fill_mask)
+    else:
+        layer = Image.new("RGBA", box, fill_rgb + (0,))
+        layer.putalpha(fill_mask)
+    layer = fade_layer(layer, opacity_percent)
+    return _text_cache.put(key, layer), key
+
+def text_segments(template, image_path=None, sku_pattern=DEFAULT_SETTINGS["sku_pattern"]):
+    # "{filename}" is the source name without extension and "{sku}" the
+    # part of it matched by sku_pattern (the whole name if nothing matches).
+    stem = os.path.splitext(os.path.basename(image_path))[0] if image_path else ""
+    match = re.search(sku_pattern, stem) if sku_pattern else None
+    fields = {"filename": stem, "sku": match.group(0) if match else stem}
+    segments = []
+    for literal, field, spec, conversion in string.Formatter().parse(template):
+        segments.append(literal)
+        if field is not None:
+            if field not in fields:
+                raise ValueError(f"Unknown text field {{{field}}}; use {{filename}} or {{sku}}")
+            segments.append(format(fields[field], spec or ""))
+    return tuple(segments)
+
+def clear_text_cache():
+    _plan_cache.clear()
+    _font_cache.clear()
+    _segment_cache.clear()
+    _text_cache.clear()
+
+# === Stage Timing ===
+STAGES = ("read", "decode", "metadata", "logo_prep", "convert", "resize", "composite", "encode", "write")
+
+@contextmanager
+def timed(timings, stage):
+    # Opt-in: with timings=None the pipeline pays nothing but a check.
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+# === Output Encoding ===
+OUTPUT_FORMATS = ("jpeg", "png", "webp", "avif", "same")
+FORMAT_EXTENSIONS = {"jpeg": ".jpg", "png": ".png", "webp": ".webp", "avif": ".avif"}
+PIL_FORMATS = {"jpeg": "JPEG", "png": "PNG", "webp": "WEBP", "avif": "AVIF"}
+ALPHA_FORMATS = ("png", "webp", "avif")
+JPEG_SUBSAMPLING = ("4:4:4", "4:2:2", "4:2:0")
+
+def avif_supported():
+    # Registered by load_plugins() from Pillow 11.3+ or pillow-avif-plugin.
+    return "AVIF" in Image.SAVE
+
+def format_for_path(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".jpeg":
+        return "jpeg"
+    for fmt, fmt_ext in FORMAT_EXTENSIONS.items():
+        if ext == fmt_ext:
+            return fmt
+    return None
+
+def resolve_output_format(image_path, output_format):
+    if output_format == "same":
+        return format_for_path(image_path) or "jpeg"
+    if output_format not in FORMAT_EXTENSIONS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    return output_format
+
+def has_alpha(image):
+    return image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+
+def encoder_params(fmt, options=None):
+    opts = dict(DEFAULT_SETTINGS)
+    opts.update(options or {})
+    quality = int(opts["quality"])
+    if fmt == "jpeg":
+        return {
+            "quality": quality,
+            "subsampling": opts["jpeg_subsampling"],
+            "optimize": bool(opts["jpeg_optimize"]),
+            "progressive": bool(opts["jpeg_progressive"])
+        }
+    if fmt == "webp":
+        if opts["webp_lossless"]:
+            return {"lossless": True, "method": int(opts["webp_method"])}
+        return {"quality": quality, "method": int(opts["webp_method"])}
+    if fmt == "avif":
+        if not avif_supported():
+            raise ValueError("AVIF output needs Pillow 11.3+ or the pillow-avif-plugin package.")
+        return {"quality": quality, "speed": int(opts["avif_speed"])}
+    return {}
+
+def encode_image(image, fp, fmt, options=None, metadata=None):
+    # Without options the old behaviour holds: Pillow picks the format
+    # from the file name and uses its own defaults. metadata comes from
+    # read_metadata and is written by every output format.
+    metadata = metadata or {}
+    if options is None or fmt is None:
+        image.save(fp, format=PIL_FORMATS.get(fmt), **metadata)
+        return
+    image.save(fp, format=PIL_FORMATS[fmt], **encoder_params(fmt, options), **metadata)
+
+# === Source Metadata ===
+# "keep" writes the ICC profile and EXIF, "icc" only the profile (EXIF can
+# carry GPS positions and camera serials), "strip" neither.
+METADATA_POLICIES = ("keep", "icc", "strip")
+ORIENTATION_TAG = 0x0112
+
+def read_metadata(image, policy="icc"):
+    # Everything here comes from the header the decode already parsed, so
+    # no file is opened twice. Returns the image turned upright (layout
+    # must see the orientation the viewer will) and the encoder arguments.
+    if policy not in METADATA_POLICIES:
+        raise ValueError(f"Unknown metadata policy: {policy!r} (expected one of {', '.join(METADATA_POLICIES)})")
+    exif = image.getexif()
+    icc_profile = image.info.get("icc_profile")
+    if exif.get(ORIENTATION_TAG, 1) in range(2, 9):
+        image = ImageOps.exif_transpose(image)
+    # Only RGB profiles still describe the pixels once they are converted
+    # for output; a CMYK or grey profile would now be wrong. The key is
+    # always set: PNG would otherwise copy the source profile on its own.
+    metadata = {"icc_profile": None}
+    if policy != "strip" and icc_profile and icc_profile[16:20] == b"RGB ":
+        metadata["icc_profile"] = icc_profile
+    if policy == "keep" and exif:
+        exif.pop(ORIENTATION_TAG, None)
+        metadata["exif"] = exif.tobytes()
+    return image, metadata
+
+# === Core Watermark Function ===
+def load_base(image_path, max_size=None):
+    image = Image.open(image_path)
+    full_w = image.width
+    if max_size:
+        # JPEG can decode at 1/2, 1/4 or 1/8 scale straight from the DCT
+        # coefficients. Keep twice the target so the LANCZOS pass stays sharp.
+        image.draft("RGB", (max_size[0] * 2, max_size[1] * 2))
+        image.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=None)
+    return image, image.width / full_w
+
+def paste_tiled_bands(base, logo, logo_key, spacing, offset, band_budget):
+    # The tile grid repeats every (logo_h + spacing) rows, so one band of
+    # whole tile rows can be pasted down the image instead of a
+    # full-canvas overlay. Band memory stays under band_budget bytes.
+    base_w, base_h = base.size
+    step_y = logo.height + max(0, int(spacing))
+    rows = max(1, band_budget // (base_w * 4 * step_y))
+    band_h = rows * step_y
+    band = get_tile_overlay((base_w, band_h), logo, logo_key, spacing, (offset[0], 0))
+    for y in range(_tile_starts(int(offset[1]), step_y, base_h).start, base_h, band_h):
+        base.paste(band, (0, y), band)
+
+def blend_prepared(base, plan, blend, timings=None):
+    # The NumPy backends keep their premultiplied layer in the plan, so it
+    # is built once per image size like the rest of the layout. Opacity is
+    # folded in there as a scalar on the unfaded layer.
+    linear = blend == "linear"
+    prepared = plan.setdefault("blend", {})
+    if blend not in prepared:
+        with timed(timings, "logo_prep"):
+            prepared[blend] = prepare_layer(plan["layer"], linear, plan.get("opacity", 100) / 100)
+    with timed(timings, "composite"):
+        blend_layer(base, prepared[blend], plan["tiles"] if plan["repeat"] else (plan["pos"],), linear)
+    return base
+
+def faded_layer(plan):
+    # The layer with its opacity applied, for the Pillow paths, and its
+    # cache key. Plans built for a NumPy blend keep the layer unfaded.
+    opacity = plan.get("opacity", 100)
+    if opacity >= 100:
+        return plan["layer"], plan["layer_key"]
+    layer = plan.get("faded")
+    if layer is None:
+        layer = plan["faded"] = fade_layer(plan["layer"], opacity)
+    return layer, plan["layer_key"] + ("opacity", opacity)
+
+def place_layer(base, plan, timings=None, memory_budget=None, blend="pillow"):
+    # Composites in place: a single layer only touches its bounding box,
+    # a tiled layout pastes the cached overlay once across the frame.
+    if blend not in BLEND_MODES:
+        raise ValueError(f"Unknown blend: {blend!r} (expected one of {', '.join(BLEND_MODES)})")
+    # A tiled gamma-space blend is Pillow's masked paste to within a level,
+    # and the cached overlay composites it faster than NumPy can.
+    numpy_blend = blend == "linear" or (blend == "numpy" and not plan["repeat"])
+    if numpy_blend and base.mode in ("RGB", "RGBA"):
+        return blend_prepared(base, plan, blend, timings)
+    layer, layer_key = faded_layer(plan)
+    if plan["repeat"]:
+        base_w, base_h = base.size
+        base_bytes = base_w * base_h * len(base.getbands())
+        if memory_budget and base_bytes + base_w * base_h * 4 > memory_budget:
+            # A full-canvas overlay would blow the budget; use whatever the
+            # decoded base leaves over (at least one tile row) for bands.
+            with timed(timings, "composite"):
+                paste_tiled_bands(base, layer, layer_key, plan["spacing"], plan["offset"],
+                                  max(0, memory_budget - base_bytes) // 2)
+        else:
+            with timed(timings, "logo_prep"):
+                overlay = get_tile_overlay(base.size, layer, layer_key, plan["spacing"],
+                                           plan["offset"], plan["tiles"])
+            with timed(timings, "composite"):
+                base.paste(overlay, (0, 0), overlay)
+    else:
+        with timed(timings, "composite"):
+            base.paste(layer, plan["pos"], layer)
+    return base
+
+def _scaled_layout(canvas_size, tile_spacing, tile_offset, px_scale, padding=None, offset=(0, 0)):
+    # Tile spacing and offset are in full-size pixels; px_scale maps them
+    # onto a downscaled image. Padding is a percentage of the shorter edge
+    # (None keeps the original 10 px margin) and offset a percentage of the
+    # width and height, so neither needs scaling.
+    if padding is None:
+        margin = round(10 * px_scale)
+    else:
+        margin = round(min(canvas_size) * padding / 100)
+    return (round(tile_spacing * px_scale),
+            (round(tile_offset[0] * px_scale), round(tile_offset[1] * px_scale)),
+            margin,
+            (round(canvas_size[0] * offset[0] / 100), round(canvas_size[1] * offset[1] / 100)))
+
+def apply_logo(base, logo_path, position, scale_percent, opacity_percent, repeat_logo=False,
+               tile_spacing=50, tile_offset=(0, 0), px_scale=1.0, timings=None, memory_budget=None,
+               rotation=0, padding=None, offset=(0, 0), blend="pillow"):
+    # rotation is in degrees counter-clockwise. A rotated tiled layout
+    # repeats the one rotated logo, so it still composites through a
+    # single cached overlay. The NumPy blends take the logo unfaded and
+    # apply the opacity when they premultiply it.
+    mtime = os.path.getmtime(logo_path)
+    late_opacity = opacity_percent if blend != "pillow" else 100
+    layer_opacity = opacity_percent if blend == "pillow" else 100
+    key = ("logo", base.size, logo_path, mtime, scale_percent, opacity_percent, position, repeat_logo,
+           tile_spacing, tuple(tile_offset), px_scale, rotation, padding, tuple(offset), late_opacity)
+    plan = _plan_cache.get(key)
+    if plan is None:
+        with timed(timings, "logo_prep"):
+            logo = get_prepared_logo(logo_path, int((base.width * scale_percent) / 100), layer_opacity)
+            logo, logo_key = get_rotated_layer(logo, (logo_path, mtime, logo.width, layer_opacity), rotation)
+            spacing, grid_offset, margin, shift = _scaled_layout(base.size, tile_spacing, tile_offset, px_scale,
+                                                                 padding, offset)
+            plan = layout_plan(base.size, logo, logo_key, position, repeat_logo, spacing, grid_offset, margin, shift)
+            plan["opacity"] = late_opacity
+            plan = _plan_cache.put(key, plan)
+    return place_layer(base, plan, timings, memory_budget, blend)
+
+def apply_text(base, text, position, size_percent, opacity_percent, repeat_logo=False, tile_spacing=50,
+               tile_offset=(0, 0), px_scale=1.0, timings=None, memory_budget=None, font_path="",
+               color="#ffffff", stroke_width=0, stroke_color="#000000", rotation=0, padding=None, offset=(0, 0),
+               blend="pillow"):
+    # text is a string or the segments from text_segments(). The font
+    # size is a percentage of the shorter image edge.
+    segments = (text,) if isinstance(text, str) else tuple(text)
+    size = max(1, round(min(base.size) * size_percent / 100))
+    stroke = max(1, round(stroke_width * px_scale)) if stroke_width else 0
+    late_opacity = opacity_percent if blend != "pillow" else 100
+    layer_opacity = opacity_percent if blend == "pillow" else 100
+    with timed(timings, "logo_prep"):
+        layer, text_key = get_text_layer(segments, font_path, size, color, layer_opacity, stroke, stroke_color)
+    if layer is None:
+        return base
+    key = ("text", base.size, text_key, position, repeat_logo, tile_spacing, tuple(tile_offset), px_scale,
+           rotation, padding, tuple(offset), late_opacity)
+    plan = _plan_cache.get(key)
+    if plan is None:
+        with timed(timings, "logo_prep"):
+            layer, layer_key = get_rotated_layer(layer, ("text",) + text_key, rotation)
+        spacing, grid_offset, margin, shift = _scaled_layout(base.size, tile_spacing, tile_offset, px_scale,
+                                                             padding, offset)
+        plan = layout_plan(base.size, layer, layer_key, position, repeat_logo, spacing, grid_offset, margin, shift)
+        plan["opacity"] = late_opacity
+        plan = _plan_cache.put(key, plan)
+    return place_layer(base, plan, timings, memory_budget, blend)
+
+def convert_for_output(base, fmt, timings=None):
+    # RGB sources are composited as decoded. Anything else is converted
+    # once up front, keeping alpha only if the output format can store it.
+    mode = "RGBA" if fmt in ALPHA_FORMATS and has_alpha(base) else "RGB"
+    if base.mode != mode:
+        with timed(timings, "convert"):
+            base = base.convert(mode)
+    return base
+
+def add_logo_watermark(image_path, logo_path, output_path, position, scale_percent, opacity_percent, repeat_logo=False,
+                       tile_spacing=50, tile_offset=(0, 0), output_options=None, max_size=None, timings=None,
+                       memory_budget=None, output_format=None, text_options=None, placement=None, blend="pillow"):
+    # image_path and output_path may also be file objects; the format is
+    # then taken from output_format instead of the file name. With
+    # text_options (see text_options_for) text is drawn instead of the logo.
+    # placement holds rotation, padding and offset (see placement_for).
+    placement = placement or {}
+    with timed(timings, "decode"):
+        base, px_scale = load_base(image_path, max_size)
+        base.load()
+    with timed(timings, "metadata"):
+        base, metadata = read_metadata(base, (output_options or {}).get("metadata", DEFAULT_SETTINGS["metadata"]))
+    fmt = output_format or format_for_path(output_path)
+    base = convert_for_output(base, fmt, timings)
+    if text_options is not None:
+        apply_text(base, position=position, opacity_percent=opacity_percent, repeat_logo=repeat_logo,
+                   tile_spacing=tile_spacing, tile_offset=tile_offset, px_scale=px_scale, timings=timings,
+                   memory_budget=memory_budget, blend=blend, **placement, **text_options)
+    else:
+        apply_logo(base, logo_path, position, scale_percent, opacity_percent, repeat_logo,
+                   tile_spacing, tile_offset, px_scale, timings, memory_budget, blend=blend, **placement)
+    with timed(timings, "encode"):
+        encode_image(base, output_path, fmt, output_options, metadata)
+
+def relative_dir(image_path, input_roots=()):
+    # The image's folder below the deepest input folder holding it, so
+    # same-named images from different sub-folders keep apart in the
+    # output; "" for files given one by one.
+    directory = os.path.dirname(os.path.abspath(image_path))
+    best = None
+    for root in input_roots:
+        root = os.path.abspath(root)
+        try:
+            if os.path.commonpath([directory, root]) != root:
+                continue
+        except ValueError:
+            continue  # another drive
+        if best is None or len(root) > len(best):
+            best = root
+    if best is None or best == directory:
+        return ""
+    return os.path.relpath(directory, best)
+
+def output_path_for(image_path, output_dir, output_format="jpeg", input_roots=()):
+    name, ext = os.path.splitext(os.path.basename(image_path))
+    fmt = resolve_output_format(image_path, output_format)
+    name = f"{name}_watermarked{FORMAT_EXTENSIONS[fmt]}"
+    return os.path.join(output_dir, relative_dir(image_path, input_roots), name)
+
+def set_pixel_limit(max_megapixels):
+    # Print-resolution scans exceed Pillow's decompression-bomb guard
+    # (about 179 MP), so the limit follows the settings instead.
+    Image.MAX_IMAGE_PIXELS = int(max_megapixels * 1_000_000) if max_megapixels else None
+
+def text_options_for(settings, image_path=None):
+    # The apply_text arguments for a text watermark, or None in logo mode.
+    if settings.get("watermark_type", "logo") != "text":
+        return None
+    return {
+        "text": text_segments(settings.get("text", ""), image_path,
+                              settings.get("sku_pattern", DEFAULT_SETTINGS["sku_pattern"])),
+        "size_percent": settings.get("text_size", DEFAULT_SETTINGS["text_size"]),
+        "font_path": settings.get("text_font", ""),
+        "color": settings.get("text_color", DEFAULT_SETTINGS["text_color"]),
+        "stroke_width": settings.get("text_stroke_width", 0),
+        "stroke_color": settings.get("text_stroke_color", DEFAULT_SETTINGS["text_stroke_color"])
+    }
+
+def placement_for(settings):
+    # The rotation, padding and offset arguments of apply_logo/apply_text.
+    return {
+        "rotation": settings.get("rotation", 0),
+        "padding": settings.get("padding"),
+        "offset": (settings.get("offset_x", 0), settings.get("offset_y", 0))
+    }
+
+def _memory_budget(settings):
+    budget_mb = settings.get("memory_budget_mb", DEFAULT_SETTINGS["memory_budget_mb"])
+    return int(budget_mb * (1 << 20)) if budget_mb else None
+
+def _watermark(source, destination, fmt, settings, timings=None, image_path=None):
+    add_logo_watermark(
+        source, settings["logo_path"], destination,
+        settings["position"], settings["scale"], settings["opacity"],
+        settings.get("repeat_logo", False),
+        settings.get("tile_spacing", 50),
+        (settings.get("tile_offset_x", 0), settings.get("tile_offset_y", 0)),
+        output_options=settings,
+        timings=timings,
+        memory_budget=_memory_budget(settings),
+        output_format=fmt,
+        text_options=text_options_for(settings, image_path),
+        placement=placement_for(settings),
+        blend=settings.get("blend", "pillow")
+    )
+
+# === Renditions ===
+def parse_rendition(spec):
+    # "name:size[:scale]", e.g. "thumb:400:30"
+    parts = spec.split(":")
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Rendition must be NAME:SIZE[:SCALE], got {spec!r}")
+    rendition = {"name": parts[0], "max_size": int(parts[1])}
+    if not rendition["name"] or rendition["max_size"] < 1:
+        raise ValueError(f"Rendition needs a name and a positive size, got {spec!r}")
+    if len(parts) == 3:
+        rendition["scale"] = float(parts[2])
+    return rendition
+
+def format_rendition(rendition):
+    spec = f"{rendition['name']}:{rendition['max_size']}"
+    if "scale" in rendition:
+        spec += f":{rendition['scale']:g}"
+    return spec
+
+def output_paths_for(image_path, settings):
+    out_path = output_path_for(image_path, settings["output_dir"], settings.get("output_format", "jpeg"),
+                               settings.get("input_roots") or ())
+    renditions = settings.get("renditions") or []
+    if not renditions:
+        return [out_path]
+    stem, ext = os.path.splitext(out_path)
+    return [f"{stem}_{r['name']}{ext}" for r in renditions]
+
+def render_renditions(source, fmt, settings, timings=None, image_path=None):
+    # One decode at the largest rendition's size (JPEG draft mode does most
+    # of the reduction), then each smaller rendition is resampled from the
+    # previous clean one rather than from the full-size image. Returns the
+    # images in settings order and the metadata they are all encoded with.
+    renditions = settings["renditions"]
+    largest = max(r["max_size"] for r in renditions)
+    with timed(timings, "decode"):
+        base, px_scale = load_base(source, (largest, largest))
+        base.load()
+    with timed(timings, "metadata"):
+        base, metadata = read_metadata(base, settings.get("metadata", DEFAULT_SETTINGS["metadata"]))
+    base = convert_for_output(base, fmt, timings)
+
+    text_options = text_options_for(settings, image_path)
+    results = {}
+    current = base
+    for rendition in sorted(renditions, key=lambda r: r["max_size"], reverse=True):
+        size = rendition["max_size"]
+        if max(current.size) > size:
+            with timed(timings, "resize"):
+                ratio = size / max(current.size)
+                resized = current.resize(
+                    (max(1, round(current.width * ratio)), max(1, round(current.height * ratio))),
+                    Image.Resampling.LANCZOS, reducing_gap=3.0
+                )
+            px_scale *= resized.width / current.width
+            current = resized
+        image = current.copy()
+        layout = {
+            "repeat_logo": settings.get("repeat_logo", False),
+            "tile_spacing": settings.get("tile_spacing", 50),
+            "tile_offset": (settings.get("tile_offset_x", 0), settings.get("tile_offset_y", 0)),
+            "px_scale": px_scale,
+            "timings": timings,
+            "memory_budget": _memory_budget(settings),
+            "blend": settings.get("blend", "pillow"),
+            **placement_for(settings)
+        }
+        if text_options is not None:
+            options = dict(text_options, size_percent=rendition.get("scale", text_options["size_percent"]))
+            apply_text(image, position=settings["position"], opacity_percent=settings["opacity"], **layout, **options)
+        else:
+            apply_logo(image, settings["logo_path"], settings["position"],
+                       rendition.get("scale", settings["scale"]), settings["opacity"], **layout)
+        results[rendition["name"]] = image
+    return [results[r["name"]] for r in renditions], metadata
+
+def _render_outputs(source, image_path, settings, timings, open_output):
+    set_pixel_limit(settings.get("max_megapixels", DEFAULT_SETTINGS["max_megapixels"]))
+    out_paths = output_paths_for(image_path, settings)
+    fmt = format_for_path(out_paths[0])
+    if not settings.get("renditions"):
+        _watermark(source, open_output(out_paths[0]), fmt, settings, timings, image_path)
+        return out_paths
+    images, metadata = render_renditions(source, fmt, settings, timings, image_path)
+    for out_path, image in zip(out_paths, images):
+        with timed(timings, "encode"):
+            encode_image(image, open_output(out_path), fmt, settings, metadata)
+    return out_paths
+
+# === Atomic Output ===
+# Outputs are written under a temporary name and renamed into place, so a
+# crash or a closed window never leaves a truncated image under the real
+# name (and the manifest never vouches for one).
+TEMP_SUFFIX = ".part"
+
+def temp_path_for(out_path):
+    # Creates an empty, uniquely named file next to out_path (and its
+    # folder if needed): writer threads and processes never share one.
+    directory = os.path.dirname(out_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix=TEMP_SUFFIX, prefix=f"{os.path.basename(out_path)}.{os.getpid()}.",
+                                    dir=directory)
+    os.close(fd)
+    return tmp_path
+
+def write_atomic(out_path, payload):
+    tmp_path = temp_path_for(out_path)
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def watermark_file(image_path, settings, timings=None):
+    temps = {}
+
+    def open_output(out_path):
+        temps[out_path] = open(temp_path_for(out_path), "wb")
+        return temps[out_path]
+
+    try:
+        out_paths = _render_outputs(image_path, image_path, settings, timings, open_output)
+        for out_path, f in temps.items():
+            f.close()
+            os.replace(f.name, out_path)
+    finally:
+        for f in temps.values():
+            f.close()
+            if os.path.exists(f.name):
+                os.remove(f.name)
+    return out_paths
+
+def render_image(data, image_path, settings, timings=None):
+    # Bytes in, bytes out: the batch pipeline does its own file I/O on
+    # threads so workers only decode, composite and encode. Returns one
+    # (output path, encoded bytes) pair per rendition.
+    buffers = {}
+
+    def open_output(out_path):
+        buffers[out_path] = io.BytesIO()
+        return buffers[out_path]
+
+    out_paths = _render_outputs(io.BytesIO(data), image_path, settings, timings, open_output)
+    return [(out_path, buffers[out_path].getvalue()) for out_path in out_paths]
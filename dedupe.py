@@ -0,0 +1,217 @@
+import os
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageChops
+
+from core import ORIENTATION_TAG, READ_FORMATS, resolve_output_format, text_options_for, temp_path_for
+from manifest import file_digest
+
+# "content" groups byte-identical files. "perceptual" also groups copies
+# that were re-encoded or renamed by a supplier: same pixel size, same
+# orientation and profile, and difference hashes per colour channel (so
+# colourways of one product shot stay apart) at most PERCEPTUAL_DISTANCE
+# bits apart; re-encoding a JPEG typically flips two or three of them.
+# A hash that close only nominates a match: shots that differ in label
+# text or body shade hash alike, so each pair is confirmed on a larger
+# decode before outputs are linked.
+DEDUPE_MODES = ("off", "content", "perceptual")
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE * 3
+PERCEPTUAL_DISTANCE = 6
+# Re-encodes down to JPEG quality 20 stay within these at VERIFY_SIZE:
+# no sample more than VERIFY_PIXEL_DIFF apart (changed text is 100+), and
+# no VERIFY_BLOCK-square block mean more than VERIFY_BLOCK_DIFF apart
+# (a recoloured body shifts every block it covers).
+VERIFY_SIZE = 256
+VERIFY_BLOCK = 8
+VERIFY_PIXEL_DIFF = 24
+VERIFY_BLOCK_DIFF = 3
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest() if data else None
+
+def _dhash(channel):
+    # One bit per horizontally adjacent pair on a (HASH_SIZE + 1) x HASH_SIZE grid.
+    pixels = channel.tobytes()
+    width = HASH_SIZE + 1
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * width + col]
+            bits = (bits << 1) | (left > pixels[row * width + col + 1])
+    return bits
+
+def perceptual_key(path):
+    with Image.open(path, formats=READ_FORMATS) as image:
+        exif = image.getexif()
+        key = (image.size, image.mode, exif.get(ORIENTATION_TAG, 1), _digest(image.info.get("icc_profile")))
+        # JPEG decodes straight to 1/8 scale here; a hash needs no more.
+        image.draft("RGB", (HASH_SIZE * 8, HASH_SIZE * 8))
+        small = image.convert("RGB").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX, reducing_gap=3.0)
+    bits = 0
+    for channel in small.split():
+        bits = (bits << HASH_SIZE * HASH_SIZE) | _dhash(channel)
+    return key, bits, _digest(exif.tobytes() if exif else None)
+
+def verify_thumbnail(path):
+    with Image.open(path, formats=READ_FORMATS) as image:
+        image.draft("RGB", (VERIFY_SIZE, VERIFY_SIZE))
+        return image.convert("RGB").resize((VERIFY_SIZE, VERIFY_SIZE), Image.Resampling.BOX)
+
+def _max_difference(a, b):
+    return max(high for _, high in ImageChops.difference(a, b).getextrema())
+
+def same_picture(a, b):
+    # a and b are verify_thumbnail()s of images with the same exact key.
+    if _max_difference(a, b) > VERIFY_PIXEL_DIFF:
+        return False
+    size = (VERIFY_SIZE // VERIFY_BLOCK,) * 2
+    box = Image.Resampling.BOX
+    return _max_difference(a.resize(size, box), b.resize(size, box)) <= VERIFY_BLOCK_DIFF
+
+def source_key(path, mode):
+    # (exact key, perceptual hash or None, EXIF digest). The EXIF digest
+    # only separates images when the output keeps EXIF, and identical
+    # bytes already imply identical EXIF.
+    if mode == "content":
+        return ("content", file_digest(path)), None, None
+    if mode == "perceptual":
+        key, bits, exif_digest = perceptual_key(path)
+        return ("perceptual",) + key, bits, exif_digest
+    raise ValueError(f"Unknown dedupe mode: {mode!r} (expected one of {', '.join(DEDUPE_MODES)})")
+
+def output_key(path, settings):
+    # Two identical sources still need their own encode if their outputs
+    # differ: another output format, or text built from the file name.
+    try:
+        fmt = resolve_output_format(path, settings.get("output_format", "jpeg"))
+        text = text_options_for(settings, path)
+    except ValueError:
+        return None
+    return fmt, tuple(text["text"]) if text else None
+
+def link_outputs(sources, destinations, hardlink=True):
+    # Each copy appears under its final name in one rename, like a normal
+    # output. Hardlinks fall back to a copy across volumes or on FAT.
+    for source, destination in zip(sources, destinations):
+        tmp_path = temp_path_for(destination)
+        try:
+            try:
+                if not hardlink:
+                    raise OSError
+                os.remove(tmp_path)  # the name is ours; link needs it free
+                os.link(source, tmp_path)
+            except OSError:
+                shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, destination)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return list(destinations)
+
+class NearMatcher:
+    # Finds an earlier image with the same exact key and a hash within
+    # distance bits. Split into distance + 1 blocks, two such hashes must
+    # agree on at least one whole block, so only images sharing a block
+    # are compared instead of every earlier image.
+    def __init__(self, distance):
+        self.distance = distance
+        self.block = -(-HASH_BITS // (distance + 1))
+        self.mask = (1 << self.block) - 1
+        self._exact = {}
+        self._blocks = {}
+
+    def match(self, key, bits, path, verify=None):
+        # Returns the path this one duplicates, or None after recording it.
+        # verify(earlier, path) must confirm a near match.
+        if bits is None:
+            if key in self._exact:
+                return self._exact[key]
+            self._exact[key] = path
+            return None
+        blocks = [(key, i, (bits >> (i * self.block)) & self.mask) for i in range(self.distance + 1)]
+        checked = set()
+        for block in blocks:
+            for other_bits, other_path in self._blocks.get(block, ()):
+                if other_path in checked or bin(bits ^ other_bits).count("1") > self.distance:
+                    continue
+                checked.add(other_path)
+                if verify is None or verify(other_path, path):
+                    return other_path
+        for block in blocks:
+            self._blocks.setdefault(block, []).append((bits, path))
+        return None
+
+# === Duplicate Index ===
+class DuplicateIndex:
+    # Hashes sources on background threads as they are added, so the GUI
+    # and CLI can start it while folders are still being scanned and the
+    # batch only waits for whatever is left.
+    def __init__(self, workers=None):
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def add(self, paths, mode):
+        if mode == "off":
+            return
+        for path in paths:
+            self._submit(path, mode)
+
+    def _submit(self, path, mode):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        signature = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            entry = self._keys.get((mode, path))
+            if entry is None or entry[0] != signature or entry[1].cancelled():
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers)
+                entry = (signature, self._executor.submit(source_key, path, mode))
+                self._keys[(mode, path)] = entry
+        return entry[1]
+
+    def group(self, paths, settings):
+        # Returns the paths to process, in order, and for each of them the
+        # paths whose outputs can be linked to its outputs instead.
+        mode = settings.get("dedupe", "off")
+        keep_exif = settings.get("metadata") == "keep"
+        futures = [(path, self._submit(path, mode)) for path in paths]
+        primaries = []
+        duplicates = {}
+        matcher = NearMatcher(PERCEPTUAL_DISTANCE)
+        thumbnails = {}
+
+        def verify(earlier, path):
+            try:
+                for candidate in (earlier, path):
+                    if candidate not in thumbnails:
+                        thumbnails[candidate] = verify_thumbnail(candidate)
+                return same_picture(thumbnails[earlier], thumbnails[path])
+            except Exception:
+                return False  # cannot confirm, so encode it separately
+        for path, future in futures:
+            primary = None
+            try:
+                if future is not None:
+                    exact, bits, exif_digest = future.result()
+                    target = output_key(path, settings)
+                    if target is not None:
+                        primary = matcher.match((exact, target, exif_digest if keep_exif else None), bits, path, verify)
+            except Exception:
+                primary = None  # unreadable here; the pipeline reports it
+            if primary is None:
+                primaries.append(path)
+            else:
+                duplicates.setdefault(primary, []).append(path)
+        return primaries, duplicates
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
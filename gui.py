@@ -0,0 +1,755 @@
+import os
+import json
+import time
+import queue
+from PIL import Image, ImageTk
+from tkinter import (
+    Label, Button, filedialog, StringVar, OptionMenu, Frame,
+    DoubleVar, Scale, Entry, Listbox, END, Checkbutton, BooleanVar,
+    messagebox, LabelFrame, Toplevel, IntVar
+)
+from tkinterdnd2 import DND_FILES, TkinterDnD
+from tkinter import ttk
+from core import (
+    apply_logo, apply_text, load_base, read_metadata, avif_supported, parse_rendition, format_rendition, text_options_for,
+    placement_for, SETTINGS_FILE, POSITIONS, OUTPUT_FORMATS, JPEG_SUBSAMPLING, METADATA_POLICIES
+)
+from batch import BatchJob, default_workers, resume_job
+from blend import BLEND_MODES, numpy_available
+from journal import JobJournal, journal_path_for
+from ingest import IngestJob
+from dedupe import DuplicateIndex, DEDUPE_MODES
+from watch import WatchJob
+
+LIST_PAGE_SIZE = 500
+
+class WatermarkApp(TkinterDnD.Tk):
+    def __init__(self):
+        super().__init__()
+        self.title("🖋 AUSVIC Logo Watermarker")
+        self.geometry("1200x900")
+        self.configure(padx=10, pady=10)
+
+        # Variables
+        self.image_paths = []
+        self.image_index = set()
+        self.ingest_jobs = []
+        # Folders added as a whole; their images keep their sub-folder in the output.
+        self.input_roots = set()
+        self.list_page = 0
+        self._list_shown = None
+        self.logo_path = StringVar()
+        self.output_dir = StringVar()
+        self.position = StringVar(value="bottom-right")
+        self.scale = DoubleVar(value=20)
+        self.opacity = DoubleVar(value=100)
+        self.rotation = DoubleVar(value=0)
+        self.padding = StringVar(value="")
+        self.offset_x = DoubleVar(value=0)
+        self.offset_y = DoubleVar(value=0)
+        self.blend = StringVar(value="pillow")
+        self.repeat_logo = BooleanVar(value=False)
+        self.text_mode = BooleanVar(value=False)
+        self.text = StringVar(value="")
+        self.text_font = StringVar(value="")
+        self.text_size = DoubleVar(value=5)
+        self.text_color = StringVar(value="#ffffff")
+        self.text_stroke_width = IntVar(value=0)
+        self.text_stroke_color = StringVar(value="#000000")
+        self.tile_spacing = IntVar(value=50)
+        self.tile_offset = (0, 0)
+        self.output_format = StringVar(value="jpeg")
+        self.quality = IntVar(value=75)
+        self.jpeg_subsampling = StringVar(value="4:2:0")
+        self.jpeg_optimize = BooleanVar(value=False)
+        self.jpeg_progressive = BooleanVar(value=False)
+        self.webp_lossless = BooleanVar(value=False)
+        self.webp_method = IntVar(value=4)
+        self.avif_speed = IntVar(value=6)
+        self.metadata = StringVar(value="icc")
+        self.renditions = StringVar(value="")
+        self.workers = IntVar(value=default_workers())
+        self.force_reprocess = BooleanVar(value=False)
+        self.dedupe = StringVar(value="off")
+        self.duplicate_index = DuplicateIndex()
+        self.instrument = BooleanVar(value=False)
+        self.profile = BooleanVar(value=False)
+        self.saved_settings = {}
+        self.batch_job = None
+        self.watch_job = None
+        self._preview_base = (None, None)
+        self._preview_after = None
+
+        # Load saved preferences
+        self.load_settings()
+        self.create_widgets()
+        for var in (self.logo_path, self.position, self.scale, self.opacity, self.rotation, self.padding,
+                    self.offset_x, self.offset_y, self.blend, self.repeat_logo, self.tile_spacing,
+                    self.text_mode, self.text, self.text_font, self.text_size, self.text_color,
+                    self.text_stroke_width, self.text_stroke_color):
+            var.trace_add("write", self.schedule_preview)
+        self.dedupe.trace_add("write", lambda *args: self.duplicate_index.add(self.image_paths, self.dedupe.get()))
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.schedule_preview()
+        self.journal = None
+        try:
+            self.journal = JobJournal(journal_path_for(SETTINGS_FILE))
+        except Exception as e:
+            messagebox.showwarning("Job Journal", f"Batches cannot be resumed after a crash:\n{e}")
+        self.after(200, self.offer_resume)
+
+    def create_widgets(self):
+        # === Live Preview Pane ===
+        preview_frame = LabelFrame(self, text="👁 Live Preview")
+        preview_frame.pack(side="right", fill="both", expand=True, padx=(10, 0))
+        self.preview_label = Label(preview_frame, text="Add an image and a logo to see a preview.")
+        self.preview_label.pack(expand=True)
+
+        # === Preview Button ===
+        Button(self, text="🔍 Preview Watermark", command=self.preview_watermark).pack(pady=5)
+
+        # === Image Frame ===
+        image_frame = LabelFrame(self, text="📸 Product Images")
+        image_frame.pack(fill="x", pady=5)
+
+        Label(image_frame, text="🎯 Drag & Drop Images or Folders, or Click to Browse:").pack()
+        self.image_listbox = Listbox(image_frame, height=6, width=60, selectmode="multiple")
+        self.image_listbox.pack(pady=5)
+        self.image_listbox.drop_target_register(DND_FILES)
+        self.image_listbox.dnd_bind("<<Drop>>", self.drop_files)
+
+        page_frame = Frame(image_frame)
+        page_frame.pack()
+        Button(page_frame, text="◀", command=lambda: self.change_page(-1)).pack(side="left")
+        self.image_count_label = Label(page_frame, text="No images")
+        self.image_count_label.pack(side="left", padx=5)
+        Button(page_frame, text="▶", command=lambda: self.change_page(1)).pack(side="left")
+
+        btn_frame = Frame(image_frame)
+        btn_frame.pack()
+        Button(btn_frame, text="📂 Browse Images", command=self.browse_images).pack(side="left", padx=5)
+        Button(btn_frame, text="🗂 Add Folder", command=self.browse_image_folder).pack(side="left")
+        Button(btn_frame, text="❌ Remove Selected", command=self.remove_selected_images).pack(side="left", padx=5)
+
+        # === Logo Frame ===
+        logo_frame = LabelFrame(self, text="🖼 AUSVIC Logo")
+        logo_frame.pack(fill="x", pady=10)
+
+        Label(logo_frame, text="Drag & Drop PNG Logo or Click to Browse:").pack()
+        self.logo_entry = Entry(logo_frame, textvariable=self.logo_path, width=60)
+        self.logo_entry.pack()
+        self.logo_entry.drop_target_register(DND_FILES)
+        self.logo_entry.dnd_bind("<<Drop>>", self.drop_logo)
+        Button(logo_frame, text="📁 Browse Logo", command=self.browse_logo).pack(pady=5)
+
+        # === Text Watermark ===
+        text_frame = LabelFrame(self, text="🔤 Text Watermark")
+        text_frame.pack(fill="x", pady=5)
+
+        Checkbutton(text_frame, text="Stamp text instead of the logo", variable=self.text_mode).pack()
+        Label(text_frame, text="Text ({filename} and {sku} are filled in per image):").pack()
+        Entry(text_frame, textvariable=self.text, width=60).pack()
+
+        font_row = Frame(text_frame)
+        font_row.pack(pady=2)
+        Entry(font_row, textvariable=self.text_font, width=45).pack(side="left")
+        Button(font_row, text="🔠 Font", command=self.browse_font).pack(side="left", padx=5)
+
+        Label(text_frame, text="Text Size (% of shorter edge):").pack()
+        Scale(text_frame, from_=1, to=30, resolution=0.5, orient="horizontal", variable=self.text_size).pack()
+
+        style_row = Frame(text_frame)
+        style_row.pack(pady=2)
+        Label(style_row, text="Colour:").pack(side="left")
+        Entry(style_row, textvariable=self.text_color, width=9).pack(side="left", padx=5)
+        Label(style_row, text="Outline:").pack(side="left")
+        Entry(style_row, textvariable=self.text_stroke_color, width=9).pack(side="left", padx=5)
+        Scale(style_row, from_=0, to=20, orient="horizontal", variable=self.text_stroke_width, length=100).pack(side="left")
+
+        # === Output Directory ===
+        output_frame = LabelFrame(self, text="📤 Output Directory")
+        output_frame.pack(fill="x", pady=10)
+
+        Entry(output_frame, textvariable=self.output_dir, width=60, state="readonly").pack(pady=2)
+        Button(output_frame, text="📁 Choose Folder", command=self.browse_output_dir).pack()
+
+        # === Settings Frame ===
+        settings_frame = LabelFrame(self, text="⚙️ Watermark Settings")
+        settings_frame.pack(fill="x", pady=10)
+
+        Label(settings_frame, text="📌 Position:").pack()
+        OptionMenu(settings_frame, self.position, *POSITIONS).pack()
+
+        Label(settings_frame, text="📏 Logo Size (% of image width):").pack()
+        Scale(settings_frame, from_=5, to=100, orient="horizontal", variable=self.scale).pack()
+
+        Label(settings_frame, text="🌫 Logo Opacity (%):").pack()
+        Scale(settings_frame, from_=0, to=100, orient="horizontal", variable=self.opacity).pack()
+
+        Label(settings_frame, text="🔄 Rotation (°):").pack()
+        Scale(settings_frame, from_=-180, to=180, orient="horizontal", variable=self.rotation).pack()
+
+        padding_row = Frame(settings_frame)
+        padding_row.pack(pady=2)
+        Label(padding_row, text="Padding (% of shorter edge, blank = 10 px):").pack(side="left")
+        Entry(padding_row, textvariable=self.padding, width=6).pack(side="left", padx=5)
+
+        offset_row = Frame(settings_frame)
+        offset_row.pack()
+        Label(offset_row, text="Offset X / Y (%):").pack(side="left")
+        Scale(offset_row, from_=-50, to=50, resolution=0.5, orient="horizontal", variable=self.offset_x,
+              length=100).pack(side="left")
+        Scale(offset_row, from_=-50, to=50, resolution=0.5, orient="horizontal", variable=self.offset_y,
+              length=100).pack(side="left")
+
+        blend_row = Frame(settings_frame)
+        blend_row.pack(pady=2)
+        Label(blend_row, text="Blending:").pack(side="left")
+        blends = [b for b in BLEND_MODES if b == "pillow" or numpy_available()]
+        OptionMenu(blend_row, self.blend, *blends).pack(side="left", padx=5)
+
+        Checkbutton(settings_frame, text="🔁 Repeat logo across image", variable=self.repeat_logo).pack(pady=5)
+
+        Label(settings_frame, text="↔ Tile Spacing (px):").pack()
+        Scale(settings_frame, from_=0, to=500, orient="horizontal", variable=self.tile_spacing).pack()
+
+        Label(settings_frame, text="⚡ Parallel Workers:").pack()
+        Scale(settings_frame, from_=1, to=max(default_workers(), 1) * 2, orient="horizontal", variable=self.workers).pack()
+
+        # === Output Format Frame ===
+        format_frame = LabelFrame(self, text="💾 Output Format")
+        format_frame.pack(fill="x", pady=10)
+
+        format_row = Frame(format_frame)
+        format_row.pack()
+        Label(format_row, text="Format:").pack(side="left")
+        formats = [f for f in OUTPUT_FORMATS if f != "avif" or avif_supported()]
+        OptionMenu(format_row, self.output_format, *formats).pack(side="left", padx=5)
+        Label(format_row, text="Subsampling:").pack(side="left")
+        OptionMenu(format_row, self.jpeg_subsampling, *JPEG_SUBSAMPLING).pack(side="left", padx=5)
+
+        Label(format_frame, text="🎚 Quality (JPEG / WebP / AVIF):").pack()
+        Scale(format_frame, from_=1, to=100, orient="horizontal", variable=self.quality).pack()
+
+        effort_row = Frame(format_frame)
+        effort_row.pack()
+        Label(effort_row, text="WebP method (0 fast - 6 small):").pack(side="left")
+        Scale(effort_row, from_=0, to=6, orient="horizontal", variable=self.webp_method).pack(side="left", padx=5)
+        if avif_supported():
+            Label(effort_row, text="AVIF speed (0 small - 10 fast):").pack(side="left")
+            Scale(effort_row, from_=0, to=10, orient="horizontal", variable=self.avif_speed).pack(side="left", padx=5)
+
+        flag_row = Frame(format_frame)
+        flag_row.pack()
+        Checkbutton(flag_row, text="Optimize", variable=self.jpeg_optimize).pack(side="left")
+        Checkbutton(flag_row, text="Progressive", variable=self.jpeg_progressive).pack(side="left")
+        Checkbutton(flag_row, text="Lossless WebP", variable=self.webp_lossless).pack(side="left")
+        Label(flag_row, text="Metadata:").pack(side="left", padx=(10, 0))
+        OptionMenu(flag_row, self.metadata, *METADATA_POLICIES).pack(side="left")
+
+        rendition_row = Frame(format_frame)
+        rendition_row.pack(pady=5)
+        Label(rendition_row, text="Renditions (name:size[:scale], ...):").pack(side="left")
+        Entry(rendition_row, textvariable=self.renditions, width=40).pack(side="left", padx=5)
+
+        # === Progress Bar ===
+        progress_frame = Frame(self)
+        progress_frame.pack(pady=5)
+        self.progress = ttk.Progressbar(progress_frame, orient="horizontal", length=400, mode="determinate")
+        self.progress.pack(side="left")
+        self.throughput_label = Label(progress_frame, text="", width=24, anchor="w")
+        self.throughput_label.pack(side="left", padx=5)
+
+        diag_frame = Frame(self)
+        diag_frame.pack()
+        Checkbutton(diag_frame, text="📊 Log stage timings", variable=self.instrument).pack(side="left")
+        Checkbutton(diag_frame, text="🧪 Profile run (single process)", variable=self.profile).pack(side="left", padx=5)
+
+        # === Final Buttons ===
+        action_frame = Frame(self)
+        action_frame.pack(pady=10)
+        self.apply_button = Button(action_frame, text="✅ Apply AUSVIC Watermark to All", command=self.apply_batch_watermark)
+        self.apply_button.pack(side="left", padx=5)
+        self.cancel_button = Button(action_frame, text="⛔ Cancel", command=self.cancel_batch, state="disabled")
+        self.cancel_button.pack(side="left")
+        Checkbutton(action_frame, text="♻ Force reprocess unchanged", variable=self.force_reprocess).pack(side="left", padx=5)
+        Label(action_frame, text="Duplicates:").pack(side="left")
+        OptionMenu(action_frame, self.dedupe, *DEDUPE_MODES).pack(side="left")
+
+        watch_frame = Frame(self)
+        watch_frame.pack()
+        self.watch_button = Button(watch_frame, text="👀 Watch Folder", command=self.toggle_watch)
+        self.watch_button.pack(side="left", padx=5)
+        self.watch_label = Label(watch_frame, text="")
+        self.watch_label.pack(side="left")
+
+    def browse_images(self):
+        files = filedialog.askopenfilenames(filetypes=[("Images", "*.png *.jpg *.jpeg *.webp *.tif *.tiff")])
+        if files:
+            self.add_images(files)
+
+    def browse_image_folder(self):
+        directory = filedialog.askdirectory()
+        if directory:
+            self.add_images([directory])
+
+    def add_images(self, paths):
+        # Folders are scanned and sniffed on a background thread; results
+        # stream in through poll_ingest so the window never blocks.
+        self.input_roots.update(os.path.abspath(path) for path in paths if os.path.isdir(path))
+        job = IngestJob(paths, self.image_index)
+        self.ingest_jobs.append(job)
+        job.start()
+        if len(self.ingest_jobs) == 1:
+            self.after(100, self.poll_ingest)
+        self.refresh_image_list()
+
+    def poll_ingest(self):
+        was_empty = not self.image_paths
+        for job in list(self.ingest_jobs):
+            while True:
+                try:
+                    kind, payload = job.events.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == "files":
+                    new = [p for p in payload if p not in self.image_index]
+                    self.image_index.update(new)
+                    self.image_paths.extend(new)
+                    # Hashing for duplicate detection runs alongside the scan.
+                    self.duplicate_index.add(new, self.dedupe.get())
+                else:
+                    self.ingest_jobs.remove(job)
+                    break
+
+        self.refresh_image_list()
+        if was_empty and self.image_paths:
+            self.schedule_preview()
+        if self.ingest_jobs:
+            self.after(100, self.poll_ingest)
+
+    def change_page(self, step):
+        last_page = max(0, (len(self.image_paths) - 1) // LIST_PAGE_SIZE)
+        self.list_page = min(max(0, self.list_page + step), last_page)
+        self.refresh_image_list()
+
+    def refresh_image_list(self):
+        # Only one page of names lives in the Listbox at a time, so a huge
+        # catalog costs no more to display than a small one.
+        total = len(self.image_paths)
+        start = self.list_page * LIST_PAGE_SIZE
+        end = min(start + LIST_PAGE_SIZE, total)
+        if self._list_shown != (start, end):
+            self.image_listbox.delete(0, END)
+            for path in self.image_paths[start:end]:
+                self.image_listbox.insert(END, os.path.basename(path))
+            self._list_shown = (start, end)
+
+        if total:
+            text = f"{start + 1:,}–{end:,} of {total:,} images"
+        else:
+            text = "No images"
+        if self.ingest_jobs:
+            text += " (scanning…)"
+        self.image_count_label.config(text=text)
+
+    def remove_selected_images(self):
+        selected = list(self.image_listbox.curselection())
+        if not selected:
+            messagebox.showinfo("No Selection", "Please select image(s) to remove.")
+            return
+        start = self.list_page * LIST_PAGE_SIZE
+        for i in reversed(selected):
+            self.image_index.discard(self.image_paths[start + i])
+            del self.image_paths[start + i]
+        self._list_shown = None
+        self.change_page(0)
+        self.schedule_preview()
+
+    def browse_logo(self):
+        file = filedialog.askopenfilename(filetypes=[("PNG Logo", "*.png")])
+        if file:
+            self.logo_path.set(file)
+
+    def browse_font(self):
+        file = filedialog.askopenfilename(filetypes=[("Fonts", "*.ttf *.otf *.ttc")])
+        if file:
+            self.text_font.set(file)
+
+    def browse_output_dir(self):
+        directory = filedialog.askdirectory()
+        if directory:
+            self.output_dir.set(directory)
+
+    def drop_files(self, event):
+        files = self.tk.splitlist(event.data)
+        if files:
+            self.add_images(files)
+
+    def drop_logo(self, event):
+        files = self.tk.splitlist(event.data)
+        for file in files:
+            if file.lower().endswith(".png"):
+                self.logo_path.set(file)
+
+    def preview_watermark(self):
+        if not self.image_paths:
+            messagebox.showwarning("No Images", "Please add at least one image to preview.")
+            return
+        if not self.text_mode.get() and not self.logo_path.get():
+            messagebox.showwarning("Missing Logo", "Please select the AUSVIC logo.")
+            return
+
+        try:
+            settings = self.current_settings()
+            img = self.get_preview_image(
+                self.image_paths[0],
+                self.logo_path.get(),
+                self.position.get(),
+                self.scale.get(),
+                self.opacity.get(),
+                self.repeat_logo.get(),
+                self.tile_spacing.get(),
+                self.tile_offset,
+                text_options=text_options_for(settings, self.image_paths[0]),
+                placement=placement_for(settings),
+                blend=settings["blend"]
+            )
+            self.show_preview_window(img)
+        except Exception as e:
+            messagebox.showerror("Preview Error", f"Failed to preview watermark:\n{e}")
+
+    def get_preview_base(self, image_path, max_size):
+        key = (image_path, os.path.getmtime(image_path), max_size)
+        cached_key, cached = self._preview_base
+        if cached_key != key:
+            base_image, px_scale = load_base(image_path, max_size)
+            base_image, _ = read_metadata(base_image, "strip")
+            cached = (base_image.convert("RGB"), px_scale)
+            self._preview_base = (key, cached)
+        return cached
+
+    def get_preview_image(self, image_path, logo_path, position, scale_percent, opacity_percent, repeat_logo,
+                          tile_spacing=50, tile_offset=(0, 0), max_size=(500, 500), text_options=None, placement=None,
+                          blend="pillow"):
+        base_image, px_scale = self.get_preview_base(image_path, max_size)
+        placement = placement or {}
+        if text_options is not None:
+            return apply_text(base_image.copy(), position=position, opacity_percent=opacity_percent,
+                              repeat_logo=repeat_logo, tile_spacing=tile_spacing, tile_offset=tile_offset,
+                              px_scale=px_scale, blend=blend, **placement, **text_options)
+        return apply_logo(base_image.copy(), logo_path, position, scale_percent, opacity_percent, repeat_logo,
+                          tile_spacing, tile_offset, px_scale, blend=blend, **placement)
+
+    def schedule_preview(self, *args):
+        if self._preview_after is not None:
+            self.after_cancel(self._preview_after)
+        self._preview_after = self.after(150, self.refresh_preview)
+
+    def refresh_preview(self):
+        self._preview_after = None
+        if not self.image_paths or not (self.text_mode.get() or self.logo_path.get()):
+            self.preview_label.config(image="", text="Add an image and a logo to see a preview.")
+            self.preview_label.image = None
+            return
+
+        try:
+            settings = self.current_settings()
+            img = self.get_preview_image(
+                self.image_paths[0],
+                self.logo_path.get(),
+                self.position.get(),
+                self.scale.get(),
+                self.opacity.get(),
+                self.repeat_logo.get(),
+                self.tile_spacing.get(),
+                self.tile_offset,
+                text_options=text_options_for(settings, self.image_paths[0]),
+                placement=placement_for(settings),
+                blend=settings["blend"]
+            )
+        except Exception as e:
+            self.preview_label.config(image="", text=f"Preview unavailable:\n{e}")
+            self.preview_label.image = None
+            return
+
+        tk_image = ImageTk.PhotoImage(img)
+        self.preview_label.config(image=tk_image, text="")
+        self.preview_label.image = tk_image
+
+    def show_preview_window(self, image):
+        win = Toplevel(self)
+        win.title("🔍 Watermark Preview")
+
+        preview_img = image.copy()
+        preview_img.thumbnail((500, 500), Image.Resampling.LANCZOS)
+        tk_image = ImageTk.PhotoImage(preview_img)
+
+        lbl = Label(win, image=tk_image)
+        lbl.image = tk_image
+        lbl.pack(padx=10, pady=10)
+
+        Button(win, text="Close", command=win.destroy).pack(pady=5)
+
+    def check_watermark_settings(self):
+        # Warns and returns False if a batch cannot run with the current settings.
+        if self.text_mode.get():
+            if not self.text.get().strip():
+                messagebox.showwarning("Missing Text", "Please enter the watermark text.")
+                return False
+        elif not self.logo_path.get():
+            messagebox.showwarning("Missing Logo", "Please select the AUSVIC logo.")
+            return False
+        if not self.output_dir.get():
+            messagebox.showwarning("Missing Output Folder", "Please choose an output directory.")
+            return False
+        try:
+            self.parse_renditions()
+        except ValueError as e:
+            messagebox.showwarning("Invalid Renditions", str(e))
+            return False
+        return True
+
+    def apply_batch_watermark(self):
+        if not self.image_paths:
+            messagebox.showwarning("Missing Images", "Please add product images.")
+            return
+        if not self.check_watermark_settings():
+            return
+
+        settings = self.current_settings()
+        settings["input_roots"] = sorted(self.input_roots)
+        self.start_batch(BatchJob(self.image_paths, settings, self.workers.get(),
+                                  force=self.force_reprocess.get(), journal=self.journal,
+                                  duplicates=self.duplicate_index))
+
+    def start_batch(self, job):
+        self.progress["maximum"] = job.total
+        self.progress["value"] = 0
+        self.apply_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        self.batch_job = job
+        job.start()
+        self.after(100, self.poll_batch)
+
+    def offer_resume(self):
+        # A batch cut short by a crash or by closing the window is still
+        # in the journal with its queued files.
+        if self.journal is None or self.batch_job is not None:
+            return
+        try:
+            unfinished = self.journal.resumable()
+        except Exception:
+            return
+        for job_id, created, remaining, total in unfinished:
+            started = time.strftime("%Y-%m-%d %H:%M", time.localtime(created))
+            if messagebox.askyesno("Resume Batch", f"A batch started {started} stopped with {remaining} of "
+                                                   f"{total} images left.\n\nResume it now?"):
+                try:
+                    job = resume_job(self.journal, job_id, self.workers.get())
+                except (KeyError, RuntimeError) as e:
+                    messagebox.showerror("Resume Batch", str(e.args[0]))
+                    return
+                self.start_batch(job)
+                return
+            self.journal.set_status(job_id, "abandoned")
+
+    def cancel_batch(self):
+        if self.batch_job is not None:
+            self.batch_job.cancel()
+            self.cancel_button.config(state="disabled")
+
+    def poll_batch(self):
+        job = self.batch_job
+        finished = False
+        while True:
+            try:
+                kind, done, total = job.events.get_nowait()
+            except queue.Empty:
+                break
+            self.progress["value"] = done
+            if kind == "finished":
+                finished = True
+
+        rate = job.stats.throughput()
+        eta = job.stats.eta(job.done)
+        if rate and eta is not None:
+            minutes, seconds = divmod(int(eta), 60)
+            self.throughput_label.config(text=f"{rate:.1f} img/s · ETA {minutes}:{seconds:02d}")
+
+        if not finished:
+            self.after(100, self.poll_batch)
+            return
+
+        self.batch_job = None
+        self.progress["value"] = 0
+        self.throughput_label.config(text=f"{job.stats.throughput():.1f} img/s" if job.stats.completed else "")
+        self.apply_button.config(state="normal")
+        self.cancel_button.config(state="disabled")
+        skipped = f"\n⏭ Skipped {len(job.skipped)} unchanged image(s)." if job.skipped else ""
+        if job.deduplicated:
+            skipped += f"\n🔗 {len(job.deduplicated)} duplicate image(s) linked, {job.encodes_saved} encode(s) saved."
+        if job.cancelled:
+            messagebox.showwarning("Cancelled", f"Batch cancelled after {job.done} of {job.total} images.{skipped}")
+        elif job.errors:
+            messagebox.showerror("Partial Success", "\n".join(job.error_lines()) + skipped)
+        else:
+            messagebox.showinfo("Success", f"✅ All images watermarked successfully!{skipped}")
+
+    def toggle_watch(self):
+        if self.watch_job is not None:
+            self.watch_job.cancel()
+            self.watch_button.config(state="disabled")
+            self.watch_label.config(text="Stopping…")
+            return
+        if not self.check_watermark_settings():
+            return
+        directory = filedialog.askdirectory(title="Folder to watch")
+        if not directory:
+            return
+        self.watch_job = WatchJob([directory], self.current_settings(), self.workers.get(), journal=self.journal)
+        self.watch_job.start()
+        self.watch_button.config(text="⏹ Stop Watching")
+        self.watch_label.config(text=f"Watching {directory}")
+        self.after(200, self.poll_watch)
+
+    def poll_watch(self):
+        # Changes made in the window apply from the next batch of arrivals.
+        job = self.watch_job
+        job.update_settings(self.current_settings())
+        stopped = False
+        while True:
+            try:
+                kind, detail = job.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "stopped":
+                stopped = True
+        if job.processed or job.errors:
+            self.watch_label.config(text=f"Watching {job.roots[0]} · {job.processed} watermarked"
+                                         + (f", {len(job.errors)} failed" if job.errors else ""))
+        if not stopped:
+            self.after(200, self.poll_watch)
+            return
+
+        self.watch_job = None
+        self.watch_button.config(text="👀 Watch Folder", state="normal")
+        self.watch_label.config(text="")
+        if job.errors:
+            messagebox.showerror("Watch Folder", "\n".join(f"{os.path.basename(path)}: {msg}" if path else msg
+                                                          for path, msg in job.errors[-20:]))
+
+    def load_settings(self):
+        if os.path.exists(SETTINGS_FILE):
+            try:
+                with open(SETTINGS_FILE, "r") as f:
+                    data = json.load(f)
+                    self.saved_settings = data
+                    self.logo_path.set(data.get("logo_path", ""))
+                    self.output_dir.set(data.get("output_dir", ""))
+                    self.position.set(data.get("position", "bottom-right"))
+                    self.scale.set(data.get("scale", 20))
+                    self.opacity.set(data.get("opacity", 100))
+                    self.rotation.set(data.get("rotation", 0))
+                    padding = data.get("padding")
+                    self.padding.set("" if padding is None else padding)
+                    self.offset_x.set(data.get("offset_x", 0))
+                    self.offset_y.set(data.get("offset_y", 0))
+                    self.blend.set(data.get("blend", "pillow"))
+                    self.repeat_logo.set(data.get("repeat_logo", False))
+                    self.text_mode.set(data.get("watermark_type", "logo") == "text")
+                    self.text.set(data.get("text", ""))
+                    self.text_font.set(data.get("text_font", ""))
+                    self.text_size.set(data.get("text_size", 5))
+                    self.text_color.set(data.get("text_color", "#ffffff"))
+                    self.text_stroke_width.set(data.get("text_stroke_width", 0))
+                    self.text_stroke_color.set(data.get("text_stroke_color", "#000000"))
+                    self.tile_spacing.set(data.get("tile_spacing", 50))
+                    self.tile_offset = (data.get("tile_offset_x", 0), data.get("tile_offset_y", 0))
+                    self.output_format.set(data.get("output_format", "jpeg"))
+                    self.quality.set(data.get("quality", 75))
+                    self.jpeg_subsampling.set(data.get("jpeg_subsampling", "4:2:0"))
+                    self.jpeg_optimize.set(data.get("jpeg_optimize", False))
+                    self.jpeg_progressive.set(data.get("jpeg_progressive", False))
+                    self.webp_lossless.set(data.get("webp_lossless", False))
+                    self.webp_method.set(data.get("webp_method", 4))
+                    self.avif_speed.set(data.get("avif_speed", 6))
+                    self.metadata.set(data.get("metadata", "icc"))
+                    self.renditions.set(", ".join(format_rendition(r) for r in data.get("renditions", [])))
+                    self.instrument.set(data.get("instrument", False))
+                    self.profile.set(data.get("profile", False))
+                    self.workers.set(data.get("workers", default_workers()))
+                    self.dedupe.set(data.get("dedupe", "off"))
+            except Exception as e:
+                messagebox.showerror("Load Error", f"Failed to load settings: {e}")
+
+    def parse_renditions(self):
+        return [parse_rendition(spec.strip()) for spec in self.renditions.get().split(",") if spec.strip()]
+
+    def current_settings(self):
+        # Start from the loaded file so keys without a widget (set by hand
+        # or through the CLI) survive a save.
+        data = dict(self.saved_settings)
+        data.update({
+            "logo_path": self.logo_path.get(),
+            "output_dir": self.output_dir.get(),
+            "position": self.position.get(),
+            "scale": self.scale.get(),
+            "opacity": self.opacity.get(),
+            "rotation": self.rotation.get(),
+            "offset_x": self.offset_x.get(),
+            "offset_y": self.offset_y.get(),
+            "blend": self.blend.get(),
+            "repeat_logo": self.repeat_logo.get(),
+            "watermark_type": "text" if self.text_mode.get() else "logo",
+            "text": self.text.get(),
+            "text_font": self.text_font.get(),
+            "text_size": self.text_size.get(),
+            "text_color": self.text_color.get(),
+            "text_stroke_width": self.text_stroke_width.get(),
+            "text_stroke_color": self.text_stroke_color.get(),
+            "tile_spacing": self.tile_spacing.get(),
+            "tile_offset_x": self.tile_offset[0],
+            "tile_offset_y": self.tile_offset[1],
+            "output_format": self.output_format.get(),
+            "quality": self.quality.get(),
+            "jpeg_subsampling": self.jpeg_subsampling.get(),
+            "jpeg_optimize": self.jpeg_optimize.get(),
+            "jpeg_progressive": self.jpeg_progressive.get(),
+            "webp_lossless": self.webp_lossless.get(),
+            "webp_method": self.webp_method.get(),
+            "avif_speed": self.avif_speed.get(),
+            "metadata": self.metadata.get(),
+            "instrument": self.instrument.get(),
+            "profile": self.profile.get(),
+            "workers": self.workers.get(),
+            "dedupe": self.dedupe.get()
+        })
+        try:
+            data["padding"] = float(self.padding.get()) if self.padding.get().strip() else None
+        except ValueError:
+            pass
+        try:
+            data["renditions"] = self.parse_renditions()
+        except ValueError:
+            pass  # keep the last valid list until the entry is fixed
+        return data
+
+    def save_settings(self):
+        data = self.current_settings()
+        try:
+            with open(SETTINGS_FILE, "w") as f:
+                json.dump(data, f, indent=4)
+        except Exception as e:
+            messagebox.showerror("Save Error", f"Failed to save settings: {e}")
+
+    def on_close(self):
+        for job in self.ingest_jobs:
+            job.cancel()
+        if self.batch_job is not None:
+            self.batch_job.cancel()
+        if self.watch_job is not None:
+            self.watch_job.cancel()
+        self.duplicate_index.close()
+        self.save_settings()
+        self.destroy()
@@ -0,0 +1,96 @@
+import os
+import time
+import queue
+import threading
+
+IMAGE_FORMATS = ("jpeg", "png", "webp", "tiff", "avif")
+
+def sniff_format(path):
+    try:
+        with open(path, "rb") as f:
+            head = f.read(16)
+    except OSError:
+        return None
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff"
+    if head[4:12] in (b"ftypavif", b"ftypavis"):
+        return "avif"
+    return None
+
+def iter_files(paths, recursive=True):
+    # Depth-first os.scandir walk that yields as it goes, so callers see
+    # the first files long before a large tree has been listed.
+    stack = []
+    for path in paths:
+        if os.path.isdir(path):
+            stack.append(path)
+        elif os.path.isfile(path):
+            yield os.path.normpath(path)
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError:
+                continue
+            subdirs = []
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            subdirs.append(entry.path)
+                    elif entry.is_file():
+                        yield os.path.normpath(entry.path)
+                except OSError:
+                    continue
+            stack.extend(reversed(subdirs))
+
+def iter_images(paths, recursive=True, seen=None):
+    seen = set() if seen is None else seen
+    for path in iter_files(paths, recursive):
+        if path in seen:
+            continue
+        if sniff_format(path) in IMAGE_FORMATS:
+            seen.add(path)
+            yield path
+
+# === Background Ingestion ===
+class IngestJob:
+    def __init__(self, paths, known=(), recursive=True, chunk_size=500):
+        self.paths = list(paths)
+        self.known = set(known)
+        self.recursive = recursive
+        self.chunk_size = chunk_size
+        self.events = queue.Queue()
+        self.found = 0
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def run(self):
+        chunk = []
+        flushed = time.monotonic()
+        for path in iter_images(self.paths, self.recursive, self.known):
+            if self._cancel.is_set():
+                break
+            chunk.append(path)
+            self.found += 1
+            if len(chunk) >= self.chunk_size or time.monotonic() - flushed > 0.2:
+                self.events.put(("files", chunk))
+                chunk = []
+                flushed = time.monotonic()
+        if chunk:
+            self.events.put(("files", chunk))
+        self.events.put(("finished", self.found))
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+
+from core import SETTINGS_FILE
+
+JOURNAL_NAME = "watermark_jobs.db"
+KEEP_FINISHED_JOBS = 20
+
+# Job states: "running" until the batch returns ("done" or "cancelled");
+# a crash leaves it "running". Both "running" and "cancelled" jobs can be
+# resumed until they are marked "abandoned", but a "running" job only once
+# the process that owns it is gone: the GUI, the CLI and cron runs share
+# this file. File states: "queued", then "done", "skipped" or "failed".
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    status TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    force INTEGER NOT NULL DEFAULT 0,
+    owner_pid INTEGER,
+    owner_host TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    job_id INTEGER NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    detail TEXT,
+    PRIMARY KEY (job_id, path)
+);
+CREATE INDEX IF NOT EXISTS files_by_status ON files (job_id, status, seq);
+"""
+
+HOST = socket.gethostname()
+
+def pid_alive(pid):
+    if os.name == "nt":
+        # os.kill(pid, 0) would terminate the process on Windows.
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return ctypes.GetLastError() == 5  # access denied: it exists
+        try:
+            code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+            return code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def owner_alive(pid, host):
+    # A process on another machine cannot be checked and counts as alive;
+    # jobs from before owners were recorded count as dead.
+    if pid is None:
+        return False
+    if host != HOST:
+        return True
+    return pid == os.getpid() or pid_alive(pid)
+
+def journal_path_for(settings_path=SETTINGS_FILE):
+    return os.path.join(os.path.dirname(os.path.abspath(settings_path)), JOURNAL_NAME)
+
+# === Job Journal ===
+class JobJournal:
+    def __init__(self, path):
+        self.path = path
+        # One connection shared by the batch threads, serialised here;
+        # WAL keeps each per-file commit to a cheap append.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner_pid", "INTEGER"), ("owner_host", "TEXT")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def create_job(self, image_paths, settings, force=False):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._prune()
+            job_id = self._conn.execute(
+                "INSERT INTO jobs (created, updated, status, settings, force, owner_pid, owner_host) "
+                "VALUES (?, ?, 'running', ?, ?, ?, ?)",
+                (now, now, json.dumps(settings), int(force), os.getpid(), HOST)
+            ).lastrowid
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO files (job_id, seq, path, status) VALUES (?, ?, ?, 'queued')",
+                ((job_id, seq, path) for seq, path in enumerate(image_paths))
+            )
+        return job_id
+
+    def _prune(self):
+        self._conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'abandoned') AND id NOT IN "
+            "(SELECT id FROM jobs WHERE status IN ('done', 'abandoned') ORDER BY id DESC LIMIT ?)",
+            (KEEP_FINISHED_JOBS,)
+        )
+
+    def mark(self, job_id, path, status, detail=None):
+        if detail is not None and not isinstance(detail, str):
+            detail = json.dumps(detail)
+        with self._lock:
+            self._conn.execute("UPDATE files SET status = ?, detail = ? WHERE job_id = ? AND path = ?",
+                               (status, detail, job_id, path))
+
+    def set_status(self, job_id, status):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ?", (status, time.time(), job_id))
+
+    def claim(self, job_id):
+        # Called by the process resuming a job, before it starts work.
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = 'running', updated = ?, owner_pid = ?, owner_host = ? "
+                               "WHERE id = ?", (time.time(), os.getpid(), HOST, job_id))
+
+    def live_owner(self, job_id):
+        # (pid, host) of the process still running the job, or None.
+        with self._lock:
+            row = self._conn.execute("SELECT status, owner_pid, owner_host FROM jobs WHERE id = ?",
+                                     (job_id,)).fetchone()
+        if row is None or row[0] != "running" or not owner_alive(row[1], row[2]):
+            return None
+        return row[1], row[2]
+
+    def resumable(self):
+        # Newest first: (job id, created, remaining, total), without the
+        # jobs another live process is still running.
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT j.id, j.created, SUM(f.status = 'queued'), COUNT(f.path), j.status, j.owner_pid, j.owner_host "
+                "FROM jobs j JOIN files f ON f.job_id = j.id WHERE j.status IN ('running', 'cancelled') "
+                "GROUP BY j.id HAVING SUM(f.status = 'queued') > 0 ORDER BY j.id DESC"
+            ).fetchall()
+        return [row[:4] for row in rows if row[4] != "running" or not owner_alive(row[5], row[6])]
+
+    def job_settings(self, job_id):
+        # (settings, force) the job was started with.
+        with self._lock:
+            row = self._conn.execute("SELECT settings, force FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"No job {job_id} in {self.path}")
+        return json.loads(row[0]), bool(row[1])
+
+    def pending_paths(self, job_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM files WHERE job_id = ? AND status = 'queued' ORDER BY seq", (job_id,)
+            ).fetchall()
+        return [path for (path,) in rows]
+
+    def counts(self, job_id):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM files WHERE job_id = ? GROUP BY status",
+                                      (job_id,)).fetchall()
+        return dict(rows)
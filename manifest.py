@@ -0,0 +1,105 @@
+import os
+import json
+import hashlib
+
+from core import DEFAULT_SETTINGS
+
+MANIFEST_NAME = ".watermark_manifest.json"
+
+# Keys that never change the pixels or bytes written for an image.
+NON_RENDER_KEYS = ("logo_path", "text_font", "output_dir", "manifest_check", "instrument", "profile",
+                   "memory_budget_mb", "max_megapixels", "io_threads", "schedule", "dedupe", "dedupe_link",
+                   "input_roots")
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def settings_digest(settings):
+    render = {k: settings.get(k, v) for k, v in DEFAULT_SETTINGS.items() if k not in NON_RENDER_KEYS}
+    return hashlib.sha256(json.dumps(render, sort_keys=True).encode("utf-8")).hexdigest()
+
+def source_fingerprint(path, check="stat"):
+    if check == "hash":
+        return file_digest(path)
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+# === Output Manifest ===
+class Manifest:
+    def __init__(self, output_dir, settings):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.check = settings.get("manifest_check", "stat")
+        # The logo file in logo mode, the font file (if any) in text mode.
+        if settings.get("watermark_type", "logo") == "text":
+            font = settings.get("text_font")
+            self.logo_digest = file_digest(font) if font else None
+        else:
+            self.logo_digest = file_digest(settings["logo_path"])
+        self.settings_digest = settings_digest(settings)
+        self.entries = {}
+        self._dirty = 0
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.entries = json.load(f).get("entries", {})
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def fingerprint(self, image_path, data=None):
+        # data, if given, is the file as already read; with "hash" it is
+        # hashed in memory instead of reading the file again.
+        if data is not None and self.check == "hash":
+            return hashlib.sha256(data).hexdigest()
+        return source_fingerprint(image_path, self.check)
+
+    def record_for(self, image_path, fingerprint=None):
+        return {
+            "source": os.path.abspath(image_path),
+            "fingerprint": fingerprint if fingerprint is not None else self.fingerprint(image_path),
+            "logo": self.logo_digest,
+            "settings": self.settings_digest
+        }
+
+    def key_for(self, out_path):
+        # Outputs in sub-folders of the output directory are keyed by
+        # their relative path; flat outputs by their name, as before.
+        return os.path.relpath(out_path, self.output_dir).replace(os.sep, "/")
+
+    def check_outputs(self, image_path, out_paths):
+        # (current, fingerprint) for all of an image's outputs. The source
+        # is fingerprinted once, and only when every output has an entry;
+        # otherwise fingerprint is None.
+        entries = [self.entries.get(self.key_for(out_path)) for out_path in out_paths]
+        if not entries or None in entries or not all(os.path.exists(out_path) for out_path in out_paths):
+            return False, None
+        try:
+            fingerprint = self.fingerprint(image_path)
+        except OSError:
+            return False, None
+        record = self.record_for(image_path, fingerprint)
+        return all(entry == record for entry in entries), fingerprint
+
+    def is_current(self, image_path, out_path):
+        return self.check_outputs(image_path, [out_path])[0]
+
+    def mark_done(self, image_path, out_path, fingerprint=None):
+        # Pass the fingerprint taken when the source was checked or read;
+        # without one the source is stat'ed or hashed again here.
+        self.entries[self.key_for(out_path)] = self.record_for(image_path, fingerprint)
+        self._dirty += 1
+        if self._dirty >= 500:
+            self.save()
+
+    def save(self):
+        if not self._dirty:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": 1, "entries": self.entries}, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = 0
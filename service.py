@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import queue
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from core import DEFAULT_SETTINGS, load_logo, resolve_output_format, set_pixel_limit, parse_rendition, format_rendition
+from batch import BatchJob, default_workers, _render
+from ingest import iter_images
+
+CONTENT_TYPES = {"jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp", "avif": "image/avif"}
+
+# Settings a request may not override: the files the service reads and
+# where it writes, what it profiles, and the pixel and memory limits that
+# protect the shared workers are fixed when it starts.
+SERVICE_ONLY_KEYS = ("logo_path", "text_font", "output_dir", "input_roots", "instrument", "profile", "io_threads",
+                     "workers", "max_megapixels", "memory_budget_mb")
+
+class ServiceError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def coerce_setting(key, value):
+    # Query-string values arrive as text; give them the type of the default.
+    if key not in DEFAULT_SETTINGS:
+        raise ServiceError(400, f"Unknown setting: {key}")
+    if key in SERVICE_ONLY_KEYS:
+        raise ServiceError(400, f"{key} is set when the service starts and cannot be changed per request.")
+    default = DEFAULT_SETTINGS[key]
+    if isinstance(default, list):
+        if isinstance(value, str):
+            value = json.loads(value)
+        if not isinstance(value, list):
+            raise ValueError(f"expected a JSON list, got {value!r}")
+        if key == "renditions":
+            return [coerce_rendition(item) for item in value]
+        return value
+    if not isinstance(value, str):
+        return value
+    if default is None:
+        # Optional numbers such as padding: blank means "not set".
+        return float(value) if value.strip() else None
+    if isinstance(default, bool):
+        return value.lower() in ("1", "true", "yes", "on")
+    if isinstance(default, (int, float)):
+        number = float(value)
+        return int(number) if number.is_integer() else number
+    return value
+
+def coerce_rendition(item):
+    # Either "name:size[:scale]" or an object with the same fields; both
+    # go through the CLI's parser so a bad one is a 400, not a KeyError.
+    if isinstance(item, dict):
+        unknown = set(item) - {"name", "max_size", "scale"}
+        if unknown or "name" not in item or "max_size" not in item:
+            raise ValueError(f"a rendition needs 'name' and 'max_size' (and optionally 'scale'), got {item!r}")
+        item = format_rendition(item)
+    if not isinstance(item, str):
+        raise ValueError(f"a rendition must be a string or an object, got {item!r}")
+    return parse_rendition(item)
+
+def _warm_worker(logo_path, max_megapixels):
+    # Runs once in each pool process so the first request it serves
+    # finds the logo already decoded.
+    set_pixel_limit(max_megapixels)
+    if logo_path and os.path.isfile(logo_path):
+        load_logo(logo_path)
+
+# === Service ===
+class WatermarkService:
+    def __init__(self, settings, workers=None, max_pending=None, max_upload_mb=200):
+        self.settings = dict(settings)
+        self.workers = max(1, int(workers or settings.get("workers") or default_workers()))
+        self.max_upload = int(max_upload_mb * (1 << 20))
+        # Requests beyond max_pending are turned away with 503 instead of
+        # queueing without bound behind a busy pool.
+        self._slots = threading.BoundedSemaphore(max_pending or self.workers * 2)
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.served = 0
+        self.failed = 0
+        warm_args = (self.settings.get("logo_path"), self.settings.get("max_megapixels", 1000))
+        if self.workers == 1:
+            # One thread in this process: caches stay warm here directly.
+            _warm_worker(*warm_args)
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            # Long-lived spawned workers keep their logo, overlay and text
+            # caches across requests.
+            ctx = multiprocessing.get_context("spawn")
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx,
+                                                initializer=_warm_worker, initargs=warm_args)
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def settings_for(self, overrides):
+        settings = dict(self.settings)
+        for key, value in (overrides or {}).items():
+            try:
+                settings[key] = coerce_setting(key, value)
+            except (TypeError, ValueError) as e:
+                raise ServiceError(400, f"Bad value for {key}: {e}")
+        if settings.get("watermark_type", "logo") != "text" and not os.path.isfile(settings.get("logo_path") or ""):
+            raise ServiceError(400, f"Logo not found: {settings.get('logo_path')!r}")
+        return settings
+
+    def health(self):
+        return {
+            "status": "ok",
+            "workers": self.workers,
+            "uptime_s": round(time.monotonic() - self.started, 3),
+            "served": self.served,
+            "failed": self.failed
+        }
+
+    def _count(self, ok):
+        with self._lock:
+            if ok:
+                self.served += 1
+            else:
+                self.failed += 1
+
+    def watermark(self, image_path, data, overrides=None, rendition=None):
+        # Returns (output file name, format, encoded bytes) for one image.
+        settings = self.settings_for(overrides)
+        renditions = settings.get("renditions") or []
+        settings["renditions"] = []
+        if rendition is not None:
+            settings["renditions"] = [r for r in renditions if r["name"] == rendition]
+            if not settings["renditions"]:
+                raise ServiceError(400, f"Unknown rendition: {rendition}")
+        try:
+            fmt = resolve_output_format(image_path, settings.get("output_format", "jpeg"))
+        except ValueError as e:
+            raise ServiceError(400, str(e))
+        settings["output_dir"] = ""
+
+        if not self._slots.acquire(timeout=1):
+            raise ServiceError(503, "Service busy, retry later.")
+        try:
+            outputs, _ = self.executor.submit(_render, image_path, data, settings).result()
+        except Exception:
+            self._count(False)
+            raise
+        finally:
+            self._slots.release()
+        self._count(True)
+        out_path, payload = outputs[0]
+        return os.path.basename(out_path), fmt, payload
+
+    def batch(self, paths, overrides=None, force=False, recursive=True, on_file=None):
+        settings = self.settings_for(overrides)
+        if not settings.get("output_dir"):
+            raise ServiceError(400, "The service was started without an output directory (serve -o DIR).")
+        settings["input_roots"] = [os.path.abspath(path) for path in paths if os.path.isdir(path)]
+        image_paths = list(iter_images(paths, recursive))
+        os.makedirs(settings["output_dir"], exist_ok=True)
+        return BatchJob(image_paths, settings, self.workers, force=force, executor=self.executor, on_file=on_file)
+
+# === HTTP Front End ===
+class ServiceHandler(BaseHTTPRequestHandler):
+    server_version = "AusvicWatermark/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > self.service.max_upload:
+            self.close_connection = True
+            raise ServiceError(413, f"Upload larger than {self.service.max_upload >> 20} MB.")
+        return self.rfile.read(length)
+
+    def read_json(self):
+        try:
+            return json.loads(self.read_body() or b"{}")
+        except ValueError as e:
+            raise ServiceError(400, f"Invalid JSON body: {e}")
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            self.send_json(200, self.service.health())
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        routes = {"/watermark": self.handle_watermark, "/batch": self.handle_batch}
+        handler = routes.get(url.path)
+        try:
+            if handler is None:
+                raise ServiceError(404, "Not found")
+            handler(url)
+            return
+        except ServiceError as e:
+            status, message = e.status, str(e)
+        except (OSError, ValueError) as e:
+            status, message = 400, str(e)
+        except Exception as e:
+            status, message = 500, f"{type(e).__name__}: {e}"
+        # The request body may not have been read; do not reuse the socket.
+        self.close_connection = True
+        self.send_json(status, {"error": message})
+
+    def handle_watermark(self, url):
+        # Either raw image bytes with settings in the query string, or a
+        # JSON body {"path": ..., "settings": {...}} naming a local file.
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        rendition = query.pop("rendition", None)
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            request = self.read_json()
+            image_path = request.get("path")
+            if not image_path:
+                raise ServiceError(400, "JSON requests need a 'path'.")
+            if not os.path.isfile(image_path):
+                raise ServiceError(404, f"File not found: {image_path}")
+            with open(image_path, "rb") as f:
+                data = f.read()
+            overrides = dict(query, **request.get("settings", {}))
+            rendition = request.get("rendition", rendition)
+        else:
+            image_path = query.pop("name", "upload.jpg")
+            data = self.read_body()
+            if not data:
+                raise ServiceError(400, "Empty upload.")
+            overrides = query
+
+        name, fmt, payload = self.service.watermark(image_path, data, overrides, rendition)
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[fmt])
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("Content-Disposition", f'inline; filename="{name}"')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_chunk(self, record):
+        line = json.dumps(record).encode("utf-8") + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def handle_batch(self, url):
+        # Streams one NDJSON line per image as it settles, then a summary.
+        request = self.read_json()
+        paths = request.get("paths") or []
+        if not paths:
+            raise ServiceError(400, "No 'paths' given.")
+        records = queue.Queue()
+        job = self.service.batch(
+            paths, request.get("settings"), bool(request.get("force")), request.get("recursive", True),
+            on_file=lambda path, status, detail: records.put((path, status, detail))
+        )
+        thread = threading.Thread(target=lambda: (job.run(), records.put(None)), daemon=True)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        thread.start()
+        try:
+            self.send_chunk({"total": job.total})
+            while True:
+                item = records.get()
+                if item is None:
+                    break
+                path, status, detail = item
+                record = {"path": path, "status": status}
+                if status in ("ok", "duplicate"):
+                    record["outputs"] = detail
+                elif status == "error":
+                    record["error"] = detail
+                self.send_chunk(record)
+            self.send_chunk({"summary": {
+                "total": job.total,
+                "processed": job.done - len(job.skipped) - len(job.deduplicated),
+                "skipped": len(job.skipped),
+                "duplicates": len(job.deduplicated),
+                "encodes_saved": job.encodes_saved,
+                "failed": len(job.errors),
+                "errors": [{"path": path, "error": msg} for path, msg in job.errors],
+                "stats": job.stats.summary()
+            }})
+            self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            # Client went away: stop feeding the pool.
+            job.cancel()
+            self.close_connection = True
+        thread.join()
+
+class WatermarkServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, quiet=False):
+        super().__init__(address, ServiceHandler)
+        self.service = service
+        self.quiet = quiet
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+def serve(settings, host="127.0.0.1", port=8765, workers=None, max_pending=None, max_upload_mb=200, quiet=False):
+    service = WatermarkService(settings, workers, max_pending, max_upload_mb)
+    server = WatermarkServer((host, port), service, quiet)
+    # SIGTERM (service managers, docker stop) shuts down like Ctrl+C.
+    signal.signal(signal.SIGTERM, _stop)
+    print(f"Watermark service on http://{host}:{server.server_port} with {service.workers} worker(s)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
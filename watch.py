@@ -0,0 +1,282 @@
+import os
+import sys
+import time
+import queue
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from batch import BatchJob, default_workers
+from ingest import iter_files, sniff_format, IMAGE_FORMATS
+
+DEBOUNCE_S = 0.4
+# After a close-after-write or a rename into the folder the file is most
+# likely complete; it only has to stay unchanged this long.
+CLOSED_GRACE_S = 0.05
+POLL_INTERVAL_S = 0.25
+IDLE_WAIT_S = 1.0
+
+# === inotify (Linux) ===
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+def _walk_dirs(root, recursive):
+    yield root
+    if not recursive:
+        return
+    for directory, subdirs, _ in os.walk(root):
+        for name in subdirs:
+            yield os.path.join(directory, name)
+
+class InotifyWatcher:
+    # Blocks in select() until the kernel reports a change, so an idle
+    # folder costs no CPU at all.
+    def __init__(self, roots, recursive=True, accept=None):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.roots = list(roots)
+        self.recursive = recursive
+        # accept(path) filters the files found by rescans.
+        self.accept = accept or (lambda path: True)
+        self._dirs = {}
+        for root in self.roots:
+            for directory in _walk_dirs(root, recursive):
+                self._watch(directory)
+
+    def _watch(self, directory):
+        wd = self._add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, "Out of inotify watches (fs.inotify.max_user_watches)")
+            return
+        self._dirs[wd] = directory
+
+    def wait(self, timeout):
+        # Returns (path, closed) for each change, [] on timeout; closed
+        # means the writer closed the file or it was renamed into place.
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped: look at everything again.
+                changed.extend((path, False) for path in iter_files(self.roots, self.recursive) if self.accept(path))
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                # A new or moved-in folder may already hold files.
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                    for subdir in _walk_dirs(path, True):
+                        self._watch(subdir)
+                    changed.extend((path, False) for path in iter_files([path], True) if self.accept(path))
+                continue
+            changed.append((path, bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO))))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+# === Polling Fallback ===
+class PollingWatcher:
+    # Compares (size, mtime) snapshots; used where inotify is missing
+    # (Windows, macOS) and for network shares that do not deliver events.
+    def __init__(self, roots, recursive=True, interval=POLL_INTERVAL_S):
+        self.roots = list(roots)
+        self.recursive = recursive
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for path in iter_files(self.roots, self.recursive):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        snapshot = self._scan()
+        changed = [(path, False) for path, sig in snapshot.items() if self._snapshot.get(path) != sig]
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+def make_watcher(roots, recursive=True, polling=False, accept=None):
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots, recursive, accept)
+        except (OSError, AttributeError):
+            pass  # no inotify here (e.g. some containers); poll instead
+    return PollingWatcher(roots, recursive)
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+# === Watch Job ===
+class WatchJob:
+    # Watches folders and feeds settled images to the batch engine through
+    # one long-lived pool, so a dropped file starts compositing without
+    # paying for worker start-up. Images already in the folders are
+    # queued once at start; the manifest skips those that are done.
+    def __init__(self, roots, settings, workers=None, recursive=True, debounce=DEBOUNCE_S, polling=False,
+                 journal=None, on_batch=None):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.settings = dict(settings)
+        self.workers = max(1, int(workers or settings.get("workers") or default_workers()))
+        self.recursive = recursive
+        self.debounce = debounce
+        self.polling = polling
+        self.journal = journal
+        # on_batch(job) is called with each finished BatchJob.
+        self.on_batch = on_batch
+        self.events = queue.Queue()
+        self.batches = 0
+        self.processed = 0
+        self.errors = []
+        self.watcher = None
+        self._job = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+        job = self._job
+        if job is not None:
+            job.cancel()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def update_settings(self, settings):
+        # Takes effect from the next batch.
+        with self._lock:
+            self.settings = dict(settings)
+
+    def _is_candidate(self, path):
+        output_dir = os.path.abspath(self.settings.get("output_dir") or "")
+        path = os.path.abspath(path)
+        if output_dir and os.path.commonpath([path, output_dir]) == output_dir:
+            return False  # our own outputs, if they land inside a watched folder
+        return not os.path.basename(path).startswith(".")
+
+    def run(self):
+        try:
+            self.watcher = make_watcher(self.roots, self.recursive, self.polling, self._is_candidate)
+            self.events.put(("watching", "polling" if isinstance(self.watcher, PollingWatcher) else "inotify"))
+            if self.workers == 1:
+                executor = ThreadPoolExecutor(max_workers=1)
+            else:
+                ctx = multiprocessing.get_context("spawn")
+                executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+            with executor:
+                # Start the workers and their imports now rather than on the
+                # first dropped file.
+                for _ in range(self.workers):
+                    executor.submit(default_workers)
+                self._loop(executor)
+        except Exception as e:
+            self.errors.append(("", f"Watch stopped: {e}"))
+        finally:
+            if self.watcher is not None:
+                self.watcher.close()
+            self.events.put(("stopped", self.processed))
+
+    def _loop(self, executor):
+        # path -> (signature, time the file counts as settled)
+        settling = {path: (_signature(path), 0.0) for path in iter_files(self.roots, self.recursive)
+                    if self._is_candidate(path)}
+        while not self._cancel.is_set():
+            now = time.monotonic()
+            if settling:
+                timeout = max(0.0, min(due for _, due in settling.values()) - now)
+            else:
+                timeout = IDLE_WAIT_S
+            for path, closed in self.watcher.wait(timeout):
+                if self._is_candidate(path):
+                    delay = min(CLOSED_GRACE_S, self.debounce) if closed else self.debounce
+                    settling[path] = (_signature(path), time.monotonic() + delay)
+
+            # A file is ready once it has gone debounce seconds without an
+            # event and its size and mtime still match; a copy in progress
+            # keeps pushing its own deadline back.
+            now = time.monotonic()
+            ready = []
+            for path, (signature, due) in list(settling.items()):
+                if now < due:
+                    continue
+                current = _signature(path)
+                if current is None:
+                    del settling[path]
+                elif current != signature:
+                    settling[path] = (current, now + self.debounce)
+                else:
+                    del settling[path]
+                    if sniff_format(path) in IMAGE_FORMATS:
+                        ready.append(path)
+            if ready:
+                self._run_batch(ready, executor)
+
+    def _run_batch(self, paths, executor):
+        with self._lock:
+            settings = dict(self.settings)
+        settings["input_roots"] = self.roots
+        os.makedirs(settings["output_dir"], exist_ok=True)
+        job = BatchJob(sorted(paths), settings, self.workers, executor=executor, journal=self.journal)
+        self._job = job
+        if self._cancel.is_set():
+            return
+        job.run()
+        self._job = None
+        self.batches += 1
+        self.processed += job.done - len(job.skipped) - len(job.deduplicated)
+        self.errors.extend(job.errors)
+        self.events.put(("batch", job))
+        if self.on_batch is not None:
+            self.on_batch(job)
@@ -1,5 +1,15 @@
 # -*- mode: python ; coding: utf-8 -*-
+# Build with: pyinstaller --noconfirm watermarker.spec
+#
+# onedir: the app starts straight from dist/watermarker/ instead of
+# unpacking a onefile archive into a temp dir on every launch.
 
+import PIL
+
+# Pillow plugins core.load_plugins() never imports (see core.PIL_PLUGINS).
+KEEP_PLUGINS = {"JpegImagePlugin", "MpoImagePlugin", "PngImagePlugin", "WebPImagePlugin",
+                "TiffImagePlugin", "AvifImagePlugin"}
+pil_excludes = [f"PIL.{name}" for name in PIL._plugins if name not in KEEP_PLUGINS]
 
 a = Analysis(
     ['watermarker.py'],
@@ -10,25 +20,24 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=pil_excludes + ['PIL.ImageQt', 'PIL.ImageShow', 'PIL.ImageGrab', 'pydoc', 'unittest'],
     noarchive=False,
-    optimize=0,
+    optimize=1,
 )
 pyz = PYZ(a.pure)
 
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.datas,
     [],
+    exclude_binaries=True,
     name='watermarker',
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
+    # UPX-packed DLLs are decompressed on every start and trip some
+    # virus scanners; the onedir bundle is left uncompressed.
+    upx=False,
     console=False,
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -37,3 +46,12 @@ exe = EXE(
     entitlements_file=None,
     icon=['logo.ico'],
 )
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='watermarker',
+)